@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2010 Adam Zapletal
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+""" Synthetic presentation decks generator, used by benchmarks.
+"""
+
+import os
+import base64
+import random
+
+# Probability for a slide to contain each kind of content
+DEFAULT_MIX = {'code': 0.3, 'images': 0.2, 'notes': 0.3, 'fx': 0.2}
+DEFAULT_RST_RATIO = 0.25
+IMAGE_NAME = 'image.gif'
+IMAGE_DATA = base64.b64decode(
+    "R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+
+PARAGRAPH = (u"Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+             u"Aenean magna tellus, fermentum nec venenatis nec, dapibus id "
+             u"metus. Phasellus nulla massa, consequat nec tempor et.")
+SNIPPETS = [
+    ('python', u"def slide_%(n)d(x):\n    return x * %(n)d"),
+    ('javascript', u"function slide%(n)d(x) {\n  return x * %(n)d;\n}"),
+    ('c', u"int slide_%(n)d(int x) {\n    return x * %(n)d;\n}"),
+]
+FX = [u'fade', u'zoom', u'spin']
+
+
+def indent(text, prefix=u'    '):
+    return u'\n'.join(prefix + line for line in text.split(u'\n'))
+
+
+def make_slide(number, format, mix, rng):
+    """ Returns the source of a single slide, in ``format`` (``markdown`` or
+        ``restructuredtext``), holding the kinds of contents picked at random
+        according to ``mix`` probabilities. The first slide is a title one.
+    """
+    title = u"Slide %d" % number
+    underline = u'=' if number == 1 else u'-'
+    lines = [title, underline * len(title), u'']
+    if rng.random() < mix.get('fx', 0):
+        lines += [u".fx: %s" % rng.choice(FX), u'']
+    lines += [PARAGRAPH, u'']
+    if rng.random() < mix.get('code', 0):
+        lang, snippet = rng.choice(SNIPPETS)
+        code = snippet % {'n': number}
+        if format == 'markdown':
+            lines += [indent(u"!%s\n%s" % (lang, code)), u'']
+        else:
+            lines += [u".. sourcecode:: %s" % lang, u'', indent(code), u'']
+    if rng.random() < mix.get('images', 0):
+        if format == 'markdown':
+            lines += [u"![image %d](%s)" % (number, IMAGE_NAME), u'']
+        else:
+            lines += [u".. image:: %s" % IMAGE_NAME, u'']
+    if rng.random() < mix.get('notes', 0):
+        lines += [u".notes: notes of slide %d" % number, u'']
+    return u'\n'.join(lines)
+
+
+def make_deck(directory, files, slides, mix=None, rst_ratio=DEFAULT_RST_RATIO,
+              seed=0):
+    """ Writes a synthetic deck of ``files`` source files holding ``slides``
+        slides each into ``directory``, along with the image they reference.
+        A ``rst_ratio`` share of files are reStructuredText ones, the others
+        are Markdown ones. Decks are reproducible for a given ``seed``.
+        Returns the list of written source files.
+    """
+    if mix is None:
+        mix = DEFAULT_MIX
+    rng = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory, IMAGE_NAME), 'wb') as image:
+        image.write(IMAGE_DATA)
+
+    sources = []
+    number = 0
+    for index in range(files):
+        if rng.random() < rst_ratio:
+            format, extension, separator = 'restructuredtext', '.rst', u'----'
+        else:
+            format, extension, separator = 'markdown', '.md', u'---'
+        contents = []
+        for _ in range(slides):
+            number += 1
+            contents.append(make_slide(number, format, mix, rng))
+        path = os.path.join(directory, '%06d%s' % (index, extension))
+        with open(path, 'wb') as source:
+            source.write((u'\n%s\n\n' % separator).join(contents)
+                         .encode('utf_8'))
+        sources.append(path)
+    return sources
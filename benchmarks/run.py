@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#  Copyright 2010 Adam Zapletal
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+""" Times the main Generator steps on synthetic decks of several sizes, and
+    compares timings against a stored baseline.
+"""
+
+import os
+import re
+import json
+import math
+import shutil
+import sys
+import tempfile
+
+from optparse import OptionParser
+from timeit import default_timer
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+import deck
+from epicslide.generator import Generator
+
+BASELINE_FILE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+BASELINE_VERSION = 1
+DEFAULT_SIZES = '10,1000,50000'
+STEPS = ('fetch_contents', 'process_macros', 'render', 'write')
+
+
+def best_time(function, repeat):
+    """ Returns the best wall time of ``repeat`` calls of ``function``.
+    """
+    times = []
+    for _ in range(repeat):
+        start = default_timer()
+        function()
+        times.append(default_timer() - start)
+    return min(times)
+
+
+def get_raw_slides(g):
+    """ Returns the ``(html, source)`` tuples of every slide of the generator
+        sources, parsed but not processed by macros yet.
+    """
+    slides = []
+    for source in g.list_sources(g.source):
+        parser = g.get_parser(os.path.splitext(source)[1])
+        if not parser:
+            continue
+        contents = open(source, 'rb').read().decode(g.encoding)
+        for html in re.split(r'<hr.+>', parser.parse(contents)):
+            slides.append((html, source))
+    return slides
+
+
+def run_benchmark(size, work_dir, slides_per_file=50, mix=None,
+                  rst_ratio=deck.DEFAULT_RST_RATIO, repeat=3, embed=False):
+    """ Times each benchmarked step on a synthetic deck of about ``size``
+        slides. Returns a dict of best times indexed by step.
+    """
+    files = int(math.ceil(size / float(slides_per_file)))
+    source = os.path.join(work_dir, 'deck')
+    deck.make_deck(source, files, min(size, slides_per_file), mix, rst_ratio)
+    g = Generator(source, embed=embed,
+                  destination_file=os.path.join(work_dir, 'deck.html'))
+    raw_slides = get_raw_slides(g)
+
+    def process_macros():
+        for html, slide_source in raw_slides:
+            g.process_macros(html, slide_source)
+
+    return {
+        'fetch_contents': best_time(lambda: g.fetch_contents(g.source),
+                                    repeat),
+        'process_macros': best_time(process_macros, repeat),
+        'render': best_time(g.render, repeat),
+        'write': best_time(g.write, repeat),
+    }
+
+
+def load_baseline(path):
+    """ Returns the results stored in the baseline file, indexed by size, or
+        an empty dict if there's no usable baseline.
+    """
+    try:
+        with open(path) as baseline:
+            data = json.load(baseline)
+    except (IOError, ValueError):
+        return {}
+    if data.get('version') != BASELINE_VERSION:
+        return {}
+    return data.get('results', {})
+
+
+def save_baseline(path, results):
+    """ Stores ``results`` as the new baseline, along with the baseline
+        results of sizes which weren't run.
+    """
+    baseline = load_baseline(path)
+    baseline.update(results)
+    with open(path, 'w') as outfile:
+        json.dump({'version': BASELINE_VERSION, 'results': baseline},
+                  outfile, indent=2, sort_keys=True)
+        outfile.write('\n')
+
+
+def compare(results, baseline, tolerance):
+    """ Returns report lines comparing ``results`` with ``baseline``, and the
+        list of ``(size, step)`` tuples slower than the baseline by more than
+        ``tolerance``.
+    """
+    line = u"%8s  %-16s  %10s  %10s  %6s"
+    lines = [line % (u'Slides', u'Step', u'Time (s)', u'Baseline', u'Ratio')]
+    regressions = []
+    for size in sorted(results, key=int):
+        for step in STEPS:
+            elapsed = results[size][step]
+            reference = baseline.get(size, {}).get(step)
+            ratio = u'-'
+            if reference:
+                ratio = u'%.2f' % (elapsed / reference)
+                if elapsed > reference * (1 + tolerance):
+                    regressions.append((size, step))
+                    ratio += u' !'
+            lines.append(line % (size, step, u'%.4f' % elapsed,
+                                 u'%.4f' % reference if reference else u'-',
+                                 ratio))
+    return lines, regressions
+
+
+def parse_mix(value):
+    """ Parses a ``kind=probability,...`` slides contents mix.
+    """
+    mix = dict((kind, 0.0) for kind in deck.DEFAULT_MIX)
+    for item in value.split(','):
+        kind, probability = item.split('=')
+        if kind not in mix:
+            raise ValueError(u"Unknown slide contents kind %s" % kind)
+        mix[kind] = float(probability)
+    return mix
+
+
+def _parse_options(args=None):
+    """ Parses benchmarks args options.
+    """
+    parser = OptionParser(usage="%prog [options]", description=__doc__)
+    parser.add_option(
+        "-b", "--baseline",
+        dest="baseline",
+        help="Baseline file (default: benchmarks/baseline.json)",
+        metavar="FILE",
+        default=BASELINE_FILE)
+    parser.add_option(
+        "-e", "--embed",
+        action="store_true",
+        dest="embed",
+        help="Build decks in embed mode",
+        default=False)
+    parser.add_option(
+        "-m", "--mix",
+        dest="mix",
+        help="Probability for a slide to contain code, images, notes and fx, "
+             "as kind=probability pairs (default: %s)"
+             % ','.join('%s=%s' % item
+                        for item in sorted(deck.DEFAULT_MIX.items())),
+        metavar="MIX",
+        default=None)
+    parser.add_option(
+        "-n", "--repeat",
+        type="int",
+        dest="repeat",
+        help="Number of runs of each step; the best time is kept "
+             "(default: 3)",
+        metavar="N",
+        default=3)
+    parser.add_option(
+        "-o", "--output",
+        dest="output",
+        help="Write results as JSON to FILE",
+        metavar="FILE",
+        default=None)
+    parser.add_option(
+        "-r", "--rst-ratio",
+        type="float",
+        dest="rst_ratio",
+        help="Share of reStructuredText source files (default: %s)"
+             % deck.DEFAULT_RST_RATIO,
+        metavar="RATIO",
+        default=deck.DEFAULT_RST_RATIO)
+    parser.add_option(
+        "-s", "--sizes",
+        dest="sizes",
+        help="Comma-separated list of deck sizes, in slides (default: %s)"
+             % DEFAULT_SIZES,
+        metavar="SIZES",
+        default=DEFAULT_SIZES)
+    parser.add_option(
+        "--save-baseline",
+        action="store_true",
+        dest="save_baseline",
+        help="Store results as the new baseline",
+        default=False)
+    parser.add_option(
+        "--slides-per-file",
+        type="int",
+        dest="slides_per_file",
+        help="Number of slides of each source file (default: 50)",
+        metavar="N",
+        default=50)
+    parser.add_option(
+        "-t", "--tolerance",
+        type="float",
+        dest="tolerance",
+        help="Slowdown relative to the baseline reported as a regression "
+             "(default: 0.2)",
+        metavar="RATIO",
+        default=0.2)
+    (options, pargs) = parser.parse_args(args)
+    return options
+
+
+def main(args=None):
+    """ Benchmarks entry point. Exits with status 1 on regressions.
+    """
+    options = _parse_options(args)
+    mix = parse_mix(options.mix) if options.mix else None
+    results = {}
+    for size in [int(size) for size in options.sizes.split(',')]:
+        work_dir = tempfile.mkdtemp()
+        try:
+            sys.stderr.write("Benchmarking %d slides...\n" % size)
+            results[str(size)] = run_benchmark(
+                size, work_dir, options.slides_per_file, mix,
+                options.rst_ratio, options.repeat, options.embed)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    lines, regressions = compare(results, load_baseline(options.baseline),
+                                 options.tolerance)
+    print u'\n'.join(lines)
+
+    if options.output:
+        with open(options.output, 'w') as outfile:
+            json.dump({'version': BASELINE_VERSION, 'results': results},
+                      outfile, indent=2, sort_keys=True)
+    if options.save_baseline:
+        save_baseline(options.baseline, results)
+    elif regressions:
+        sys.stderr.write("%d regression(s) beyond %d%% of the baseline\n"
+                         % (len(regressions), options.tolerance * 100))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2010 Adam Zapletal
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+import utils
+
+# Bump this when the format of cached values changes
+CACHE_VERSION = 5
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+ENTRY_SUFFIX = '.cache'
+
+
+class SlideCache(object):
+    """Persistent cache storing pickled values in a directory, one file per
+       entry named after the entry key. When the cache grows bigger than
+       ``max_size`` bytes, the least recently used entries are evicted.
+    """
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, *parts):
+        """Computes an entry key from a list of hashable parts."""
+        digest = hashlib.sha1(repr((CACHE_VERSION,) + parts))
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        """Returns the file path of the entry stored under ``key``."""
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key, default=None):
+        """Returns the value stored under ``key``, or ``default`` if there's
+           no such entry or if it can't be read.
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as entry:
+                value = pickle.load(entry)
+        except Exception:
+            # Missing, truncated or otherwise unreadable entry
+            return default
+        try:
+            # Mark entry as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        """Stores ``value`` under ``key``. Entry files are written atomically
+           so that concurrent builds never read partial entries.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as entry:
+                pickle.dump(value, entry, pickle.HIGHEST_PROTOCOL)
+            utils.replace_file(tmp_path, self.get_path(key))
+        except (IOError, OSError, pickle.PicklingError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        for path, size, mtime in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def entries(self):
+        """Returns a list of ``(path, size, mtime)`` tuples for every entry
+           currently stored in the cache.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self):
+        """Removes least recently used entries until the cache size fits in
+           ``max_size``. Returns the number of removed entries.
+        """
+        entries = self.entries()
+        total_size = sum(size for path, size, mtime in entries)
+        removed = 0
+        if total_size <= self.max_size:
+            return removed
+        entries.sort(key=lambda entry: entry[2])
+        for path, size, mtime in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            removed += 1
+        return removed
+
+
+class BuildManifest(object):
+    """Records, for every source file of a presentation, its modification
+       time, its size, the slides parsed from it and the status of the images
+       they embed, so that the next builds only need to parse files which
+       changed in between. The manifest is
+       discarded when the build ``settings`` change. A manifest without
+       ``path`` is only kept in memory.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.settings = None
+        self.entries = {}
+        self.seen = set()
+        self.loaded = False
+
+    def load(self, settings):
+        """Loads manifest entries matching the build ``settings`` from disk,
+           unless they're already loaded. Returns ``False`` if no manifest
+           matching these settings could be loaded.
+        """
+        if self.loaded and settings == self.settings:
+            return True
+        self.settings = settings
+        self.entries = {}
+        self.seen = set()
+        self.loaded = True
+        if self.path is None:
+            return False
+        try:
+            with open(self.path, 'rb') as manifest:
+                data = pickle.load(manifest)
+        except Exception:
+            return False
+        if (not isinstance(data, dict)
+            or data.get('version') != CACHE_VERSION
+            or data.get('settings') != settings):
+            return False
+        self.entries = data['files']
+        return True
+
+    def save(self):
+        """Writes manifest to disk. Only entries of the source files seen
+           since the manifest was loaded are kept.
+        """
+        files = dict((path, entry) for (path, entry) in self.entries.items()
+                     if path in self.seen)
+        if self.path is None:
+            self.entries = files
+            self.seen = set()
+            return
+        data = {'version': CACHE_VERSION, 'settings': self.settings,
+                'files': files}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as manifest:
+                pickle.dump(data, manifest, pickle.HIGHEST_PROTOCOL)
+            utils.replace_file(tmp_path, self.path)
+        except (IOError, OSError, pickle.PicklingError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise IOError(u"Unable to write build manifest %s" % self.path)
+        self.entries = files
+        self.seen = set()
+
+    def get_slides(self, source):
+        """Returns the slides recorded for ``source`` if the file didn't
+           change since then, ``None`` otherwise.
+        """
+        path = os.path.abspath(source)
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+            return None
+        for image, status in entry['images'].items():
+            if utils.get_file_status(image) != status:
+                return None
+        self.seen.add(path)
+        return entry['slides']
+
+    def update(self, source, slides, stat=None, images=None):
+        """Records the slides parsed from ``source``. ``stat`` should be the
+           file status taken before it was read, so that a file changed while
+           being parsed is parsed again on next build. ``images`` is the
+           status of the images embedded in slides, indexed by their path.
+        """
+        path = os.path.abspath(source)
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return
+        self.entries[path] = {'mtime': stat.st_mtime, 'size': stat.st_size,
+                              'slides': slides, 'images': images or {}}
+        self.seen.add(path)
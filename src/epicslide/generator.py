@@ -16,18 +16,34 @@
 
 import os
 import re
-import codecs
+import copy
+import hashlib
 import inspect
+import itertools
 import jinja2
+import multiprocessing
+import pygments
 import shutil
+import sys
 import tempfile
 import utils
 import ConfigParser
 
-from subprocess import Popen
+from subprocess import PIPE, Popen
 
 import macro as macro_module
-from parser import Parser
+from cache import BuildManifest, SlideCache
+from parser import EXTENSIONS_FORMATS, Parser, get_versions
+from profiler import Profiler
+from slide import Slide, SlideSource, SlideSpool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 
 BASE_DIR = os.path.dirname(__file__)
@@ -35,6 +51,11 @@ THEMES_DIR = os.path.join(BASE_DIR, 'themes')
 TOC_MAX_LEVEL = 2
 VALID_LINENOS = ('no', 'inline', 'table')
 
+# Parsers and template environments are shared by every generator of the
+# process, so that batch builds only set them up once
+_parsers = {}
+_template_environments = {}
+
 
 class Generator(object):
     """The Generator class takes and processes presentation source as a file, a
@@ -50,47 +71,79 @@ class Generator(object):
         macro_module.NotesMacro,
         macro_module.QRMacro,
     ]
-    user_css = []
-    user_js = []
 
     def __init__(self, source, **kwargs):
         """ Configures this generator. Available ``args`` are:
             - ``source``: source file or directory path
             Available ``kwargs`` are:
+            - ``cache_dir``: directory where parsed slides are cached across
+                             runs. Default: None (no cache).
+            - ``cache_size``: maximum size of the cache, in megabytes.
+                              Default: 100.
             - ``copy_theme``: copy theme directory and files into presentation
                               one. Default: False.
             - ``debug``: enables debug mode. Default: False.
             - ``destination_file``: path to html or PDF destination file.
                                     Default: presentation.html.
+            - ``dedupe_images``: in embed mode, embeds each image once and
+                                 sets its references using javascript.
+                                 Ignored for PDF files. Default: False.
             - ``direct``: enables direct rendering presentation to stdout.
                           Default: False.
             - ``embed``: generates a standalone document, with embedded assets.
                          Default: False.
             - ``encoding``: the encoding to use for this presentation. Default: utf8.
             - ``extensions``: Comma separated list of markdown extensions. Default: None.
+            - ``incremental``: only parse source files which changed since the
+                               previous build. Default: False.
+            - ``jobs``: number of worker processes used to parse sources and
+                        to export PDF files. Default: 1 (no worker processes).
             - ``linenos``: Line numbers style ('no', 'inline' or 'table'). Default: inline.
             - ``logger``: a logger lambda to use for logging. Default: None.
+            - ``manifest_file``: path to the build manifest used in
+                                 incremental mode. Default: destination file
+                                 path followed by ``.manifest``.
+            - ``pdf_chunk_size``: number of slides rendered by each worker
+                                  process in PDF export when ``jobs`` is
+                                  greater than 1. Default: 100.
             - ``presenter_notes``: enable presenter notes. Default: True.
+            - ``profile``: records the time spent in each build phase, parser,
+                           macro and source file. Default: False.
             - ``relative``: enable relative asset urls. Default: False.
             - ``theme``: path to the theme to use for this presentation. Default: default.
             - ``verbose``: enables verbose output. Default: False.
         """
+        self.cache_dir = kwargs.get('cache_dir', None)
+        self.cache_size = kwargs.get('cache_size', 100)
         self.copy_theme = kwargs.get('copy_theme', False)
         self.debug = kwargs.get('debug', False)
         self.destination_file = kwargs.get('destination_file',
                                            self.DEFAULT_DESTINATION)
+        self.dedupe_images = kwargs.get('dedupe_images', False)
         self.direct = kwargs.get('direct', False)
         self.embed = kwargs.get('embed', False)
         self.encoding = kwargs.get('encoding', 'utf8')
         self.extensions = kwargs.get('extensions', None)
+        self.incremental = kwargs.get('incremental', False)
+        self.jobs = kwargs.get('jobs', 1) or 1
         self.linenos = self.linenos_check(kwargs.get('linenos'))
         self.logger = kwargs.get('logger', None)
+        self.manifest_file = kwargs.get('manifest_file', None)
+        self.pdf_chunk_size = kwargs.get('pdf_chunk_size', 100)
         self.presenter_notes = kwargs.get('presenter_notes', True)
+        self.profiler = Profiler(enabled=kwargs.get('profile', False))
         self.relative = kwargs.get('relative', False)
         self.theme = kwargs.get('theme', 'default')
         self.verbose = kwargs.get('verbose', False)
         self.num_slides = 0
         self.__toc = []
+        self.__slide_sources = {}
+        self.__source_images = {}
+        self.__macro_pipeline = None
+        self.__macro_pipeline_key = None
+
+        self.user_css = []
+        self.user_js = []
 
         # macros registering
         self.macros = []
@@ -131,6 +184,8 @@ class Generator(object):
         elif self.destination_file.endswith('.pdf'):
             self.file_type = 'pdf'
             self.embed = True
+            # WeasyPrint doesn't run javascript
+            self.dedupe_images = False
         else:
             raise IOError(u"This program can only write html or pdf files. "
                            "Please use one of these file extensions in the "
@@ -139,6 +194,17 @@ class Generator(object):
         self.theme_dir = self.find_theme_dir(self.theme, self.copy_theme)
         self.template_file = self.get_template_file()
 
+        self.cache = None
+        if self.cache_dir:
+            self.cache = SlideCache(self.cache_dir,
+                                    int(self.cache_size * 1024 * 1024))
+
+        self.manifest = None
+        if self.incremental:
+            if not self.manifest_file:
+                self.manifest_file = self.destination_file + '.manifest'
+            self.manifest = BuildManifest(self.manifest_file)
+
     """
     TODO: merge css & js into assets
     """
@@ -154,6 +220,7 @@ class Generator(object):
                 if not os.path.exists(css_path):
                     raise IOError('%s user css file not found' % (css_path,))
                 self.user_css.append({
+                    'path': css_path,
                     'path_url': utils.get_path_url(css_path, self.relative),
                     'contents': open(css_path).read(),
                 })
@@ -170,6 +237,7 @@ class Generator(object):
                 if not os.path.exists(js_path):
                     raise IOError('%s user js file not found' % (js_path,))
                 self.user_js.append({
+                    'path': js_path,
                     'path_url': utils.get_path_url(js_path, self.relative),
                     'contents': open(js_path).read(),
                 })
@@ -203,11 +271,47 @@ class Generator(object):
                 raise IOError(u"Direct output mode is not available for PDF "
                                "export")
             else:
-                print self.render().encode(self.encoding)
+                with self.profiler.measure('phases', 'build'):
+                    for chunk in self.stream():
+                        sys.stdout.write(chunk.encode(self.encoding))
+                sys.stdout.write('\n')
         else:
-            self.write()
+            with self.profiler.measure('phases', 'build'):
+                self.write()
             self.log(u"Generated file: %s" % self.destination_file)
 
+    def get_template(self):
+        """ Returns the compiled Jinja2 template. Compiled templates are kept
+            by the template environment, which only compiles them again when
+            their source changes, and in its bytecode cache across runs.
+        """
+        with self.profiler.measure('phases', 'template load'):
+            environment = self.get_template_environment()
+            return environment.get_template(
+                os.path.basename(self.template_file))
+
+    def get_template_environment(self):
+        """ Returns the Jinja2 environment loading templates from the
+            template file directory, the theme directory, the default theme
+            directory and then the themes directory. Environments are shared
+            by generators using the same templates.
+        """
+        search_path = [os.path.dirname(self.template_file), self.theme_dir,
+                       os.path.join(THEMES_DIR, 'default'), THEMES_DIR]
+        key = (tuple(search_path), self.encoding, self.cache_dir)
+        if key not in _template_environments:
+            bytecode_dir = None
+            if self.cache_dir:
+                bytecode_dir = os.path.join(self.cache_dir, 'templates')
+                if not os.path.isdir(bytecode_dir):
+                    os.makedirs(bytecode_dir)
+            _template_environments[key] = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(search_path,
+                                               encoding=self.encoding),
+                bytecode_cache=jinja2.FileSystemBytecodeCache(bytecode_dir),
+                auto_reload=True)
+        return _template_environments[key]
+
     def get_template_file(self):
         """ Retrieves Jinja2 template file path.
         """
@@ -222,40 +326,149 @@ class Generator(object):
         """ Recursively fetches Markdown contents from a single file or
             directory containing itself Markdown files.
         """
-        slides = []
+        return list(self.iter_contents(source))
 
-        if type(source) is list:
-            for entry in source:
-                slides.extend(self.fetch_contents(entry))
-        elif os.path.isdir(source):
-            self.log(u"Entering %s" % source)
-            entries = os.listdir(source)
-            entries.sort()
-            for entry in entries:
-                slides.extend(self.fetch_contents(os.path.join(source, entry)))
-        else:
-            try:
-                parser = Parser(os.path.splitext(source)[1], self.encoding,
-                    self.extensions)
-            except NotImplementedError:
-                return slides
+    def fetch_contents_parallel(self, source):
+        """ Fetches contents like ``fetch_contents`` does, but parses and
+            processes source files in a pool of ``jobs`` worker processes.
+            Slides are returned in the same order as the serial walk.
+        """
+        return list(self.iter_contents_parallel(source))
 
-            self.log(u"Adding   %s (%s)" % (source, parser.format))
+    def iter_contents(self, source):
+        """ Iterates over the slides of ``source``, which can be a file, a
+            directory or a list of them. Source files are found, parsed, split
+            and processed by macros as slides are consumed, so that only one
+            file's slides are held at once.
+        """
+        if self.jobs > 1:
+            iterator = self.iter_contents_parallel(source)
+        else:
+            iterator = itertools.chain.from_iterable(
+                itertools.imap(self.fetch_file_contents,
+                               self.iter_sources(source)))
 
-            try:
-                file = codecs.open(source, encoding=self.encoding)
-                file_contents = file.read()
-            except UnicodeDecodeError:
-                self.log(u"Unable to decode source %s: skipping" % source,
-                         'warning')
-            else:
-                inner_slides = re.split(r'<hr.+>', parser.parse(file_contents))
-                for inner_slide in inner_slides:
-                    slides.append(self.get_slide_vars(inner_slide, source))
+        found = False
+        for slide in iterator:
+            found = True
+            yield slide
 
-        if not slides:
+        if not found:
             self.log(u"Exiting  %s: no contents found" % source, 'notice')
 
+    def iter_contents_parallel(self, source):
+        """ Iterates over slides like ``iter_contents`` does, but parses and
+            processes source files in a pool of ``jobs`` worker processes.
+            Slides come in the same order as the serial walk.
+        """
+        sources = []
+        for path in self.iter_sources(source):
+            slides = stat = None
+            if not self.get_parser(os.path.splitext(path)[1]):
+                # Not a source file, which may not even exist
+                slides = []
+            elif self.manifest is not None:
+                slides = self.manifest.get_slides(path)
+                if slides is None:
+                    stat = os.stat(path)
+            sources.append((path, slides, stat))
+
+        pending = [path for (path, slides, stat) in sources if slides is None]
+        if not pending:
+            for path, slides, stat in sources:
+                for slide in slides:
+                    yield slide
+            return
+
+        pool = multiprocessing.Pool(min(self.jobs, len(pending)),
+                                    _init_worker, (self,))
+        try:
+            # Results come in order, as soon as they're parsed
+            parsed = pool.imap(_parse_file_contents, pending)
+            for path, slides, stat in sources:
+                if slides is None:
+                    slides, images, records = next(parsed)
+                    if records:
+                        self.profiler.merge(records)
+                    if slides and self.manifest is not None:
+                        self.manifest.update(path, slides, stat, images)
+                for slide in slides:
+                    yield slide
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def fetch_file_contents(self, source):
+        """ Returns a single source file slides vars. In incremental mode,
+            slides of files which didn't change since the previous build are
+            taken from the build manifest instead of being parsed again.
+        """
+        if (self.manifest is None
+            or not self.get_parser(os.path.splitext(source)[1])):
+            return self.parse_file_contents(source)
+
+        slides = self.manifest.get_slides(source)
+        if slides is None:
+            stat = os.stat(source)
+            slides = self.parse_file_contents(source)
+            if slides:
+                self.manifest.update(source, slides, stat,
+                                     self.pop_source_images(source))
+        return slides
+
+    def parse_file_contents(self, source):
+        """ Parses a single source file and returns its slides vars. Returns
+            an empty list if the file format isn't supported or if the file
+            can't be decoded.
+        """
+        parser = self.get_parser(os.path.splitext(source)[1])
+        if not parser:
+            return []
+
+        self.log(u"Adding   %s (%s)" % (source, parser.format))
+
+        with self.profiler.measure('sources', source):
+            return self.parse_source(source, parser)
+
+    def parse_source(self, source, parser):
+        """ Reads, parses and processes a single source file with
+            ``parser``, or takes its slides vars from the cache.
+        """
+        slides = []
+
+        with self.profiler.measure('phases', 'read'):
+            raw_contents = open(source, 'rb').read()
+        self.profiler.add('phases', 'read', size=len(raw_contents))
+        self.profiler.add('sources', source, size=len(raw_contents))
+
+        if self.cache:
+            with self.profiler.measure('phases', 'cache'):
+                cache_key = self.get_cache_key(source, raw_contents, parser)
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                cached_slides, images = cached
+                if all(utils.get_file_status(path) == status
+                       for path, status in images.items()):
+                    self.__source_images[source] = images
+                    return cached_slides
+
+        try:
+            file_contents = raw_contents.decode(self.encoding)
+        except UnicodeDecodeError:
+            self.log(u"Unable to decode source %s: skipping" % source,
+                     'warning')
+        else:
+            with self.profiler.measure('parsers', parser.format,
+                                       len(raw_contents)):
+                html = parser.parse(file_contents)
+            images = self.get_embedded_images(html, source)
+            self.__source_images[source] = images
+            inner_slides = re.split(r'<hr.+>', html)
+            for inner_slide in inner_slides:
+                slides.append(self.get_slide_vars(inner_slide, source))
+            if self.cache:
+                self.cache.set(cache_key, (slides, images))
+
         return slides
 
     def find_theme_dir(self, theme, copy_theme=False):
@@ -280,6 +493,67 @@ class Generator(object):
             self.theme_dir = target_theme_dir
         return self.theme_dir
 
+    def get_cache_key(self, source, raw_contents, parser):
+        """ Computes the cache key of a source file's slides. It covers the
+            file contents as well as every setting which alters parsing and
+            macros processing.
+        """
+        return self.cache.key(hashlib.sha1(raw_contents).hexdigest(),
+                              source, os.path.abspath(source), parser.format,
+                              self.get_settings())
+
+    def get_embedded_images(self, html, source):
+        """ Returns the status of the local images referenced by ``html``,
+            parsed from ``source``, indexed by their path. In embed mode,
+            slides hold the images data, so they're stale as soon as one of
+            these images changes. Deduplicated images are only embedded at
+            render time, and are left out.
+        """
+        images = {}
+        if not self.embed or self.dedupe_images:
+            return images
+        source_dir = os.path.dirname(source)
+        for url in macro_module.EmbedImagesMacro.images_re.findall(html):
+            if url.startswith(('data:', 'file://', 'http://', 'https://')):
+                continue
+            path = os.path.abspath(os.path.join(source_dir, url))
+            images[path] = utils.get_file_status(path)
+        return images
+
+    def pop_source_images(self, source):
+        """ Returns the status of the images embedded in the slides last
+            parsed from ``source``, see ``get_embedded_images``.
+        """
+        return self.__source_images.pop(source, {})
+
+    def get_parser(self, extension):
+        """ Returns the parser for source files with this ``extension``, or
+            ``None`` if their format isn't supported. Parsers are shared by
+            files with the same format, encoding and markdown extensions,
+            across generators.
+        """
+        if extension not in EXTENSIONS_FORMATS:
+            return None
+        key = (extension, self.encoding, self.extensions)
+        if key not in _parsers:
+            try:
+                _parsers[key] = Parser(extension, self.encoding,
+                                       self.extensions)
+            except NotImplementedError:
+                _parsers[key] = None
+        return _parsers[key]
+
+    def get_settings(self):
+        """ Returns a tuple of every setting which alters the slides parsed
+            from a source file.
+        """
+        macros = tuple('%s.%s' % (m.__module__, m.__name__)
+                       for m in self.macros)
+        return (os.getcwd(), self.encoding, self.extensions, macros,
+                self.embed, self.relative, self.linenos,
+                self.presenter_notes, self.dedupe_images,
+                pygments.__version__) + get_versions()
+
     def get_css(self):
         """ Fetches and returns stylesheet file path or contents, for both
             print and screen contexts, depending if we want a standalone
@@ -297,14 +571,14 @@ class Generator(object):
 
         css['print'] = {
             'path_url': utils.get_path_url(print_css, self.relative),
-            'contents': open(print_css).read(),
+            'contents': self.read_css(print_css),
         }
 
         screen_css = os.path.join(self.theme_dir, 'css', 'screen.css')
         if (os.path.exists(screen_css)):
             css['screen'] = {
                 'path_url': utils.get_path_url(screen_css, self.relative),
-                'contents': open(screen_css).read(),
+                'contents': self.read_css(screen_css),
             }
         else:
             self.log(u"No screen stylesheet provided in current theme",
@@ -312,6 +586,20 @@ class Generator(object):
 
         return css
 
+    def get_user_css(self):
+        """ Returns user stylesheets, with their background images embedded
+            in embed mode.
+        """
+        if not self.embed:
+            return self.user_css
+        user_css = []
+        for css in self.user_css:
+            with self.profiler.measure('phases', 'embed',
+                                       len(css['contents'])):
+                user_css.append(dict(css, contents=utils.embed_css_images(
+                    css['contents'], os.path.dirname(css['path']))))
+        return user_css
+
     def get_js(self):
         """ Fetches and returns javascript file path or contents, depending if
             we want a standalone presentation or not.
@@ -330,8 +618,9 @@ class Generator(object):
         }
 
     def get_slide_vars(self, slide_src, source=None):
-        """ Computes a single slide template vars from its html source code.
-            Also extracts slide informations for the table of contents.
+        """ Computes a single slide template vars from its html source code,
+            as a ``Slide`` instance. Also extracts slide informations for the
+            table of contents.
         """
         find = re.search(r'(<h(\d+?).*?>(.+?)</h\d>)\s?(.+)?', slide_src,
                          re.DOTALL | re.UNICODE)
@@ -362,47 +651,147 @@ class Generator(object):
                     presenter_notes = content[find.end():].strip()
                 content = content[:find.start()]
 
-        source_dict = {}
-
-        if source:
-            source_dict = {'rel_path': source,
-                           'abs_path': os.path.abspath(source)}
-
         if header or content:
-            return {'header': header, 'title': title, 'level': level,
-                    'content': content, 'classes': slide_classes,
-                    'source': source_dict, 'presenter_notes': presenter_notes}
+            return Slide(header=header, title=title, level=level,
+                         content=content, classes=slide_classes,
+                         source=self.get_slide_source(source),
+                         presenter_notes=presenter_notes)
+
+    def get_slide_source(self, source):
+        """ Returns the source reference of slides parsed from ``source``,
+            shared by all of them.
+        """
+        if not source:
+            return None
+        if source not in self.__slide_sources:
+            self.__slide_sources[source] = SlideSource(source)
+        return self.__slide_sources[source]
+
+    def get_watched_paths(self):
+        """ Returns the list of files and directories which alter the
+            presentation when they change.
+        """
+        if type(self.source) is list:
+            paths = list(self.source)
+        else:
+            paths = [self.source]
+        paths.append(self.theme_dir)
+        paths.append(self.template_file)
+        paths.extend(css['path'] for css in self.user_css)
+        paths.extend(js['path'] for js in self.user_js)
+        return [path for path in paths if path and os.path.exists(path)]
 
     def get_template_vars(self, slides):
-        """ Computes template vars from slides html source code.
+        """ Computes template vars from slides html source code. ``slides``
+            can be any iterable of slides: it's consumed once, slides being
+            numbered and spooled as they come.
         """
-        try:
-            head_title = slides[0]['title']
-        except (IndexError, TypeError):
-            head_title = "Untitled Presentation"
-
-        for slide_index, slide_vars in enumerate(slides):
-            if not slide_vars:
-                continue
-            self.num_slides += 1
-            slide_number = slide_vars['number'] = self.num_slides
-            if slide_vars['level'] and slide_vars['level'] <= TOC_MAX_LEVEL:
-                self.add_toc_entry(slide_vars['title'], slide_vars['level'],
-                                   slide_number)
-            else:
-                # Put something in the TOC even if it doesn't have a title or level
-                self.add_toc_entry(u"-", 1, slide_number)
+        head_title = "Untitled Presentation"
+        dedupe_images = self.embed and self.dedupe_images
+        images = {}
+        spool = SlideSpool()
+
+        for index, slide_vars in enumerate(self.number_slides(slides)):
+            if index == 0 and slide_vars:
+                head_title = slide_vars['title']
+            if dedupe_images and slide_vars:
+                # Slides may be kept for the next builds, and keep their
+                # images references
+                slide_vars = copy.copy(slide_vars)
+                for field in ('header', 'content', 'presenter_notes'):
+                    slide_vars[field] = utils.replace_image_refs(
+                        slide_vars.get(field), images)
+            spool.append(slide_vars)
+
+        user_js = self.user_js
+        if images:
+            with self.profiler.measure('phases', 'embed'):
+                images_js = utils.get_images_js(images)
+            if images_js:
+                user_js = user_js + [{'path_url': None,
+                                      'contents': images_js}]
 
         return {'head_title': head_title, 'num_slides': str(self.num_slides),
-                'slides': slides, 'toc': self.toc, 'embed': self.embed,
+                'slides': spool, 'toc': self.toc, 'embed': self.embed,
                 'css': self.get_css(), 'js': self.get_js(),
-                'user_css': self.user_css, 'user_js': self.user_js}
+                'user_css': self.get_user_css(), 'user_js': user_js}
+
+    def number_slides(self, slides):
+        """ Numbers slides as they're iterated over, and builds the table of
+            contents along.
+        """
+        self.num_slides = 0
+        self.__toc = []
+
+        for slide_vars in slides:
+            if slide_vars:
+                self.num_slides += 1
+                slide_number = slide_vars['number'] = self.num_slides
+                if (slide_vars['level']
+                    and slide_vars['level'] <= TOC_MAX_LEVEL):
+                    self.add_toc_entry(slide_vars['title'],
+                                       slide_vars['level'], slide_number)
+                else:
+                    # Put something in the TOC even if it doesn't have a title or level
+                    self.add_toc_entry(u"-", 1, slide_number)
+            yield slide_vars
 
     def linenos_check(self, value):
         """ Checks and returns a valid value for the ``linenos`` option.
         """
         return value if value in VALID_LINENOS else 'inline'
 
+    def list_sources(self, source):
+        """ Recursively lists the files found in ``source``, which can be a
+            file, a directory or a list of them, in processing order.
+        """
+        return list(self.iter_sources(source))
+
+    def iter_sources(self, source):
+        """ Iterates over the files found in ``source``, which can be a file,
+            a directory or a list of them, in processing order: directories
+            are walked depth first, their entries sorted by name. Files of
+            unsupported formats found in directories are skipped.
+        """
+        pending = [(source, None)]
+        while pending:
+            path, is_dir = pending.pop()
+            if type(path) is list:
+                pending.extend((entry, None) for entry in reversed(path))
+                continue
+            if is_dir is None:
+                is_dir = os.path.isdir(path)
+            if is_dir:
+                self.log(u"Entering %s" % path)
+                with self.profiler.measure('phases', 'walk'):
+                    entries = self.scan_directory(path)
+                pending.extend(reversed(entries))
+            else:
+                yield path
+
+    def scan_directory(self, path):
+        """ Returns the ``(path, is_dir)`` tuples of the subdirectories and
+            supported source files of the ``path`` directory, sorted by name.
+            Other files are pruned on their extension alone. With ``scandir``,
+            file types come from the directory listing itself rather than
+            from a ``stat`` call per entry.
+        """
+        entries = []
+        if scandir is not None:
+            for entry in scandir(path):
+                if entry.is_dir():
+                    entries.append((entry.name, True))
+                elif os.path.splitext(entry.name)[1] in EXTENSIONS_FORMATS:
+                    entries.append((entry.name, False))
+        else:
+            for name in os.listdir(path):
+                if os.path.isdir(os.path.join(path, name)):
+                    entries.append((name, True))
+                elif os.path.splitext(name)[1] in EXTENSIONS_FORMATS:
+                    entries.append((name, False))
+        entries.sort()
+        return [(os.path.join(path, name), is_dir) for name, is_dir in entries]
+
     def log(self, message, type='notice'):
         """ Logs a message (eventually, override to do something more clever).
         """
@@ -443,22 +832,38 @@ class Generator(object):
                 .replace('\r', '').split('\n')
         return config
 
+    def get_macro_pipeline(self):
+        """ Returns the macros pipeline. It's built once and reused for every
+            slide, unless macros or macros related settings change.
+        """
+        key = (tuple(self.macros), self.logger, self.embed, self.relative,
+               self.linenos, self.cache, self.dedupe_images)
+        if self.__macro_pipeline_key != key:
+            options = {'relative': self.relative, 'linenos': self.linenos,
+                       'cache': self.cache,
+                       'dedupe_images': self.dedupe_images}
+            self.__macro_pipeline = macro_module.MacroPipeline(
+                self.macros, logger=self.logger, embed=self.embed,
+                options=options, log=self.log, profiler=self.profiler)
+            self.__macro_pipeline_key = key
+        return self.__macro_pipeline
+
     def process_macros(self, content, source=None):
         """ Processed all macros.
         """
-        macro_options = {'relative': self.relative, 'linenos': self.linenos}
-        classes = []
-        for macro_class in self.macros:
-            try:
-                macro = macro_class(logger=self.logger, embed=self.embed,
-                    options=macro_options)
-                content, add_classes = macro.process(content, source)
-                if add_classes:
-                    classes += add_classes
-            except Exception, e:
-                self.log(u"%s processing failed in %s: %s"
-                         % (macro, source, e))
-        return content, classes
+        context = macro_module.MacroContext(source)
+        return self.get_macro_pipeline().process(content, context)
+
+    def read_css(self, css_path):
+        """ Reads a stylesheet, and embeds its background images in embed
+            mode.
+        """
+        contents = open(css_path).read()
+        if self.embed:
+            with self.profiler.measure('phases', 'embed', len(contents)):
+                contents = utils.embed_css_images(contents,
+                                                  os.path.dirname(css_path))
+        return contents
 
     def register_macro(self, *macros):
         """ Registers macro classes passed a method arguments.
@@ -470,43 +875,166 @@ class Generator(object):
                 raise TypeError("Coundn't register macro; a macro must inherit"
                                 " from macro.Macro")
 
+    def reload_user_assets(self):
+        """ Reads user css and javascript files contents again.
+        """
+        for asset in self.user_css + self.user_js:
+            if os.path.exists(asset['path']):
+                asset['contents'] = open(asset['path']).read()
+
     def render(self):
         """ Returns generated html code.
         """
-        template_src = codecs.open(self.template_file, encoding=self.encoding)
-        template = jinja2.Template(template_src.read())
-        slides = self.fetch_contents(self.source)
-        context = self.get_template_vars(slides)
-
-        html = template.render(context)
-
-        if self.embed:
-            images = re.findall(r'\s+background(?:-image)?:\surl\((.+?)\).+;',
-                                html, re.DOTALL | re.UNICODE)
-
-            for img_url in images:
-                img_url = img_url.replace('"', '').replace("'", '')
-
-                source = os.path.join(THEMES_DIR, self.theme, 'css')
-
-                encoded_url = utils.encode_image_from_url(img_url, source)
-
-                html = html.replace(img_url, encoded_url, 1)
-
+        template = self.get_template()
+        context = self.get_context()
+        with self.profiler.measure('phases', 'template'):
+            html = template.render(context)
+        self.profiler.add('phases', 'template', size=len(html))
         return html
 
+    def get_context(self):
+        """ Fetches and processes the presentation sources, and returns the
+            template context.
+        """
+        if self.manifest is not None:
+            with self.profiler.measure('phases', 'manifest'):
+                loaded = self.manifest.load(self.get_settings())
+            if not loaded:
+                self.log(u"No valid build manifest found: full rebuild")
+        with self.profiler.measure('phases', 'fetch'):
+            context = self.get_template_vars(self.iter_contents(self.source))
+        if self.cache:
+            with self.profiler.measure('phases', 'cache'):
+                self.cache.evict()
+        if self.manifest is not None:
+            with self.profiler.measure('phases', 'manifest'):
+                self.manifest.save()
+        return context
+
+    def stream(self):
+        """ Returns an iterator over generated html code chunks, rendered as
+            they're consumed.
+        """
+        template = self.get_template()
+        chunks = template.generate(self.get_context())
+        if not self.profiler.enabled:
+            return chunks
+        return self.profiler.iterate('phases', 'template', chunks)
+
     def write(self):
         """ Writes generated presentation code into the destination file.
+            Html code is streamed to the file as it's rendered, so that the
+            whole document is never held in memory.
         """
-        html = self.render()
-
         if self.file_type == 'pdf':
-            self.write_pdf(html)
-        else:
-            outfile = codecs.open(self.destination_file, 'w', encoding='utf_8')
-            outfile.write(html)
+            if self.jobs > 1:
+                self.write_pdf_chunks()
+            else:
+                self.write_pdf(self.render())
+            return
+
+        # A symlinked destination is written through
+        destination_file = os.path.realpath(self.destination_file)
+        destination_dir = os.path.dirname(destination_file)
+        fd, tmp_path = tempfile.mkstemp(dir=destination_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as outfile:
+                for chunk in self.stream():
+                    outfile.write(chunk.encode('utf_8'))
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0666 & ~umask)
+            # Readers never see a partially written presentation
+            utils.replace_file(tmp_path, destination_file)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
     def write_pdf(self, html):
+        """ Writes a PDF export using WeasyPrint. The WeasyPrint python API
+            is used when available, the ``weasyprint`` command otherwise.
+        """
+        try:
+            import weasyprint
+        except ImportError:
+            weasyprint = None
+        with self.profiler.measure('phases', 'pdf', len(html)):
+            if weasyprint is None:
+                self.write_pdf_command(html)
+            else:
+                self.write_pdf_weasyprint(html, weasyprint)
+
+    def write_pdf_weasyprint(self, html, weasyprint):
+        """ Writes a PDF export in process using the WeasyPrint python API.
+        """
+        # Relative asset urls are relative to the current directory
+        base_url = os.getcwd() + os.sep
+        try:
+            document = weasyprint.HTML(string=html, base_url=base_url)
+            document.write_pdf(self.destination_file)
+        except Exception, e:
+            raise EnvironmentError(u"Unable to generate PDF file using "
+                                    "WeasyPrint: %s" % e)
+
+    def write_pdf_chunks(self):
+        """ Writes a PDF export of a large presentation by splitting its
+            slides in chunks of ``pdf_chunk_size`` slides, rendered by
+            WeasyPrint in a pool of ``jobs`` worker processes. Chunks pages
+            are then merged in order using PyPDF2. Slides keep their number
+            in the whole presentation.
+        """
+        try:
+            import weasyprint
+            import PyPDF2
+        except ImportError:
+            self.log(u"Chunked PDF export requires weasyprint and PyPDF2 "
+                     "python packages: exporting as a whole", 'warning')
+            self.write_pdf(self.render())
+            return
+
+        template = self.get_template()
+        context = self.get_context()
+        size = self.pdf_chunk_size
+        if len(context['slides']) <= size:
+            self.write_pdf(template.render(context))
+            return
+        slides = iter(context['slides'])
+        chunks = iter(lambda: list(itertools.islice(slides, size)), [])
+        last_index = (len(context['slides']) - 1) // size
+
+        base_url = os.getcwd() + os.sep
+        chunks_dir = tempfile.mkdtemp()
+        try:
+            tasks = []
+            for index, chunk in enumerate(chunks):
+                chunk_context = dict(context, slides=chunk)
+                if index < last_index:
+                    # Table of contents only follows the last slide
+                    chunk_context['toc'] = []
+                tasks.append((template.render(chunk_context), base_url,
+                              os.path.join(chunks_dir, '%06d.pdf' % index)))
+
+            with self.profiler.measure('phases', 'pdf',
+                                       sum(len(task[0]) for task in tasks)):
+                pool = multiprocessing.Pool(min(self.jobs, len(tasks)))
+                try:
+                    chunk_files = pool.map(_write_pdf_chunk, tasks)
+                finally:
+                    pool.close()
+                    pool.join()
+
+            with self.profiler.measure('phases', 'pdf merge'):
+                merger = PyPDF2.PdfFileMerger()
+                for chunk_file in chunk_files:
+                    merger.append(chunk_file)
+                with open(self.destination_file, 'wb') as outfile:
+                    merger.write(outfile)
+                merger.close()
+        finally:
+            shutil.rmtree(chunks_dir, ignore_errors=True)
+
+    def write_pdf_command(self, html):
         """ Writes a PDF export from the command line using WeasyPrint.
         """
         try:
@@ -516,14 +1044,50 @@ class Generator(object):
         except Exception:
             raise IOError(u"Unable to create temporary file, aborting")
 
-        dummy_fh = open(os.path.devnull, 'w')
-
         try:
             command = ["weasyprint", f.name, self.destination_file]
 
-            Popen(command, stderr=dummy_fh).communicate()
+            process = Popen(command, stdout=PIPE, stderr=PIPE)
+            output, errors = process.communicate()
         except Exception:
             raise EnvironmentError(u"Unable to generate PDF file using "
                                     "WeasyPrint. Is it installed and available?")
         finally:
-            dummy_fh.close()
+            os.remove(f.name)
+
+        if process.returncode != 0:
+            raise EnvironmentError(u"Unable to generate PDF file using "
+                                    "WeasyPrint: %s"
+                                    % errors.decode('utf_8', 'replace').strip())
+
+_worker_generator = None
+
+
+def _init_worker(generator):
+    """ Stores the generator used by the current worker process.
+    """
+    global _worker_generator
+    _worker_generator = generator
+
+
+def _parse_file_contents(source):
+    """ Worker entry point used by ``Generator.iter_contents_parallel``.
+        Returns the parsed slides along with the status of the images they
+        embed and the worker profiler records.
+    """
+    profiler = _worker_generator.profiler
+    profiler.reset()
+    slides = _worker_generator.parse_file_contents(source)
+    images = _worker_generator.pop_source_images(source)
+    return slides, images, profiler.records if profiler.enabled else None
+
+
+
+def _write_pdf_chunk(task):
+    """ Worker entry point used by ``Generator.write_pdf_chunks``.
+    """
+    import weasyprint
+
+    html, base_url, destination_file = task
+    weasyprint.HTML(string=html, base_url=base_url).write_pdf(destination_file)
+    return destination_file
@@ -16,28 +16,74 @@
 
 import os
 import re
+import hashlib
 import htmlentitydefs
 import pygments
 import sys
 import utils
 
+from collections import OrderedDict
 from pygments.lexers import get_lexer_by_name
 from pygments.formatters import HtmlFormatter
 
+# Maximum number of Pygments lexers kept in cache
+LEXERS_CACHE_SIZE = 64
+
+_lexers = OrderedDict()
+_formatters = {}
+
+
 def print_function(*args):
     print args
 
 
+def null_function(*args):
+    pass
+
+
+def get_lexer(name):
+    """Returns the Pygments lexer for the ``name`` language. Looking lexers
+       up is slow, so the most recently used ones are kept in a cache shared
+       by all macros. Raises ``ValueError`` for unknown languages.
+    """
+    try:
+        lexer = _lexers.pop(name)
+    except KeyError:
+        try:
+            lexer = get_lexer_by_name(name)
+        except Exception:
+            lexer = None
+        if len(_lexers) >= LEXERS_CACHE_SIZE:
+            _lexers.popitem(last=False)
+    _lexers[name] = lexer
+    if lexer is None:
+        raise ValueError(u"Unknown lexer %s" % name)
+    return lexer
+
+
+def get_formatter(linenos):
+    """Returns the shared html formatter for a line numbers style."""
+    if linenos not in _formatters:
+        _formatters[linenos] = HtmlFormatter(linenos=linenos,
+                                             nobackground=True)
+    return _formatters[linenos]
+
+
 class Macro(object):
     """Base class for Macros. A Macro aims to analyse, process and eventually
        alter some provided HTML contents and to provide supplementary
        informations to the slide context.
     """
     options = {}
+    # Strings which must appear in a content for the macro to alter it; a
+    # macro without triggers processes every content.
+    triggers = ()
 
     def __init__(self, logger=sys.stdout, embed=False, options=None):
         if logger == sys.stdout:
             self.logger = print_function
+        elif logger is None:
+            self.logger = null_function
         else:
             self.logger = logger
         self.embed = embed
@@ -51,10 +97,74 @@ class Macro(object):
         return content, []
 
 
+class MacroContext(object):
+    """Holds the informations relative to a single call of a macros pipeline:
+       the slide source file, and the css classes added by macros.
+    """
+    def __init__(self, source=None):
+        self.source = source
+        self.classes = []
+
+
+class MacroPipeline(object):
+    """Chain of macros processing slides contents. Each macro is instantiated
+       once when the pipeline is built, with options shared by all of them,
+       and is then reused for every processed content.
+    """
+    def __init__(self, macro_classes, logger=None, embed=False, options=None,
+                 log=None, profiler=None):
+        self.options = options or {}
+        self.profiler = profiler
+        self.macros = [macro_class(logger=logger, embed=embed,
+                                   options=self.options)
+                       for macro_class in macro_classes]
+        self.log = log
+
+    def process(self, content, context):
+        """Runs ``content`` through every macro of the pipeline. Returns the
+           processed content along with the css classes macros added to the
+           ``context``. Macros are skipped when none of their triggers appear
+           in contents; each trigger is looked up once per contents, even if
+           triggers overlap each other.
+        """
+        found = {}
+        for macro in self.macros:
+            if macro.triggers:
+                for trigger in macro.triggers:
+                    if trigger not in found:
+                        found[trigger] = trigger in content
+                if not any(found[trigger] for trigger in macro.triggers):
+                    continue
+            try:
+                if self.profiler and self.profiler.enabled:
+                    with self.profiler.measure('macros',
+                                               macro.__class__.__name__,
+                                               len(content)):
+                        new_content, add_classes = macro.process(
+                            content, context.source)
+                else:
+                    new_content, add_classes = macro.process(content,
+                                                             context.source)
+                if add_classes:
+                    context.classes += add_classes
+            except Exception, e:
+                if self.log:
+                    self.log(u"%s processing failed in %s: %s"
+                             % (macro, context.source, e))
+                continue
+            if new_content != content:
+                # Scan again, the macro may have added triggers
+                content = new_content
+                found = {}
+        return content, context.classes
+
+
 class CodeHighlightingMacro(Macro):
     """This Macro performs syntax coloration in slide code blocks using
        Pygments.
     """
+    triggers = (u'<pre',)
+
     code_blocks_re = re.compile(
         r'(<pre.+?>(<code>)?\s?!(\w+?)\n(.*?)(</code>)?</pre>)',
         re.UNICODE | re.MULTILINE | re.DOTALL)
@@ -68,58 +178,98 @@ class CodeHighlightingMacro(Macro):
         f = lambda m: defs[m.group(1)] if len(m.groups()) > 0 else m.group(0)
         return self.html_entity_re.sub(f, string)
 
-    def process(self, content, source=None):
-        code_blocks = self.code_blocks_re.findall(content)
-        if not code_blocks:
-            return content, []
+    def highlight(self, code, lang, lexer, linenos):
+        """Highlights a code snippet. If a cache is provided in the ``cache``
+           option, highlighted snippets are stored in it, so that recurring
+           snippets are only highlighted once.
+        """
+        cache = self.options.get('cache')
+        if cache:
+            raw_code = code.encode('utf_8') if isinstance(code, unicode) \
+                else code
+            key = cache.key('highlight', lang, linenos,
+                            hashlib.sha1(raw_code).hexdigest(),
+                            pygments.__version__)
+            pretty_code = cache.get(key)
+            if pretty_code is not None:
+                return pretty_code
+        pretty_code = pygments.highlight(code, lexer, get_formatter(linenos))
+        if cache:
+            cache.set(key, pretty_code)
+        return pretty_code
 
-        classes = []
-        for block, void1, lang, code, void2 in code_blocks:
+    def process(self, content, source=None):
+        linenos = self.options.get('linenos', False)
+        if linenos == 'no':
+            linenos = False
+        # Blocks following one with an unknown lexer are left untouched
+        state = {'failed': False}
+
+        def highlight_block(match):
+            lang, code = match.group(3), match.group(4)
+            if state['failed']:
+                return match.group(0)
             try:
-                lexer = get_lexer_by_name(lang)
+                lexer = get_lexer(lang)
             except Exception:
                 self.logger(u"Unknown pygment lexer \"%s\", skipping"
                             % lang, 'warning')
-                return content, classes
-
-            if 'linenos' not in self.options or self.options['linenos'] =='no':
-                self.options['linenos'] = False
+                state['failed'] = True
+                return match.group(0)
+            return self.highlight(self.descape(code), lang, lexer, linenos)
 
-            formatter = HtmlFormatter(linenos=self.options['linenos'],
-                                      nobackground=True)
-            pretty_code = pygments.highlight(self.descape(code), lexer,
-                                             formatter)
-            content = content.replace(block, pretty_code, 1)
+        content, count = self.code_blocks_re.subn(highlight_block, content)
+        if not count or state['failed']:
+            return content, []
 
         return content, [u'has_code']
 
 
 class EmbedImagesMacro(Macro):
     """This Macro extracts images url and embed them using the base64
-       algorithm.
+       algorithm. With the ``dedupe_images`` option, images are replaced by a
+       reference to a single copy of each image set by javascript.
     """
+    triggers = (u'<img',)
+
+    images_re = re.compile(r'<img\s.*?src="(.+?)"\s?.*?/?>',
+                           re.DOTALL | re.UNICODE)
+
     def process(self, content, source=None):
         classes = []
 
         if not self.embed:
             return content, classes
 
-        images = re.findall(r'<img\s.*?src="(.+?)"\s?.*?/?>', content,
-                            re.DOTALL | re.UNICODE)
-
         source_dir = os.path.dirname(source)
+        # Images following one which can't be embedded are left untouched
+        state = {'failed': False}
+
+        def embed_image(match):
+            image_url = match.group(1)
+            if state['failed']:
+                return match.group(0)
 
-        for image_url in images:
             encoded_url = utils.encode_image_from_url(image_url, source_dir)
 
             if not encoded_url:
-                self.logger(u"Failed to embed image \"%s\"" % image_url, 'warning')
-                return content, classes
+                self.logger(u"Failed to embed image \"%s\"" % image_url,
+                            'warning')
+                state['failed'] = True
+                return match.group(0)
 
-            content = content.replace(u"src=\"" + image_url,
-                                      u"src=\"" + encoded_url, 1)
-            print type(image_url), self.logger, sys.stdout
             self.logger(u"Embedded image %s" % image_url, 'notice')
+            if self.options.get('dedupe_images'):
+                # The image itself is set once for all its references
+                real_path = utils.get_image_path(image_url, source_dir)
+                encoded_url = u'%s" data-embedded-image-path="%s' % (
+                    utils.PLACEHOLDER_IMAGE, utils.get_image_ref(real_path))
+            tag = match.group(0)
+            start = match.start(1) - match.start()
+            end = match.end(1) - match.start()
+            return tag[:start] + encoded_url + tag[end:]
+
+        content = self.images_re.sub(embed_image, content)
 
         return content, classes
 
@@ -128,6 +278,8 @@ class FixImagePathsMacro(Macro):
     """This Macro replaces html image paths with fully qualified absolute
        urls.
     """
+    triggers = (u'<img',)
+
     relative = False
 
     def process(self, content, source=None):
@@ -153,6 +305,8 @@ class FxMacro(Macro):
     """This Macro processes fx directives, ie adds specific css classes
        named after what the parser found in them.
     """
+    triggers = (u'.fx:',)
+
     def process(self, content, source=None):
         classes = []
 
@@ -167,6 +321,8 @@ class FxMacro(Macro):
 
 class NotesMacro(Macro):
     """This Macro processes Notes."""
+    triggers = (u'.notes:',)
+
     def process(self, content, source=None):
         classes = []
 
@@ -181,6 +337,8 @@ class NotesMacro(Macro):
 
 class QRMacro(Macro):
     """This Macro generates a QR Code with Google Chart API."""
+    triggers = (u'.qr:',)
+
     def process(self, content, source=None):
         classes = []
 
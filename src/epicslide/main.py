@@ -15,12 +15,22 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import os
+import multiprocessing
 import sys
 
 try:
     from epicslide import generator
+    from epicslide import profiler
+    from epicslide import server
+    from epicslide import utils
+    from epicslide import watcher
 except ImportError:
     import generator
+    import profiler
+    import server
+    import utils
+    import watcher
 
 from optparse import OptionParser
 
@@ -30,10 +40,31 @@ def _parse_options(args=None):
     """
 
     parser = OptionParser(
-        usage="%prog [options] input.md ...",
+        usage="%prog [options] input.md ...\n"
+              "       %prog [options] config.cfg [config.cfg ...]\n"
+              "       %prog [options] build-all manifest\n"
+              "       %prog [options] serve input.md",
         description="Generates an HTML5 or PDF "
                     "slideshow from Markdown or other formats")
 
+    parser.add_option(
+        "--cache-dir",
+        dest="cache_dir",
+        help="Cache parsed slides and highlighted code snippets in DIR, so "
+             "that unchanged source files and snippets are not processed "
+             "again on the next runs",
+        metavar="DIR",
+        default=None)
+
+    parser.add_option(
+        "--cache-size",
+        type="int",
+        dest="cache_size",
+        help="Maximum size of the slides cache in megabytes; least recently "
+             "used entries are evicted beyond it (default: 100)",
+        metavar="MB",
+        default=100)
+
     parser.add_option(
         "-c", "--copy-theme",
         action="store_true",
@@ -56,6 +87,14 @@ def _parse_options(args=None):
         metavar="FILE",
         default="presentation.html")
 
+    parser.add_option(
+        "--dedupe-images",
+        action="store_true",
+        dest="dedupe_images",
+        help="With --embed, store each image once in the presentation and "
+             "set its references using javascript (ignored for PDF exports)",
+        default=False)
+
     parser.add_option(
         "-e", "--encoding",
         dest="encoding",
@@ -63,6 +102,14 @@ def _parse_options(args=None):
         metavar="ENCODING",
         default="utf8")
 
+    parser.add_option(
+        "--host",
+        dest="host",
+        help="Address the serve command listens on (default: %s)"
+             % server.DEFAULT_HOST,
+        metavar="HOST",
+        default=server.DEFAULT_HOST)
+
     parser.add_option(
         "-i", "--embed",
         action="store_true",
@@ -72,6 +119,24 @@ def _parse_options(args=None):
              "standalone document",
         default=False)
 
+    parser.add_option(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        help="Only parse source files which changed since the previous "
+             "build, using a manifest stored next to the destination file",
+        default=False)
+
+    parser.add_option(
+        "-j", "--jobs",
+        type="int",
+        dest="jobs",
+        help="Number of worker processes used to parse source files and "
+             "to export PDF files, or to build presentations when several "
+             "are given (default: 1)",
+        metavar="N",
+        default=1)
+
     parser.add_option(
         "-l", "--linenos",
         type="choice",
@@ -99,6 +164,41 @@ def _parse_options(args=None):
         help="Don't include presenter notes in the output",
         default=True)
 
+    parser.add_option(
+        "--pdf-chunk-size",
+        type="int",
+        dest="pdf_chunk_size",
+        help="With --jobs, number of slides rendered by each worker process "
+             "when exporting to PDF; chunks are merged using PyPDF2 "
+             "(default: 100)",
+        metavar="N",
+        default=100)
+
+    parser.add_option(
+        "-p", "--port",
+        type="int",
+        dest="port",
+        help="Port the serve command listens on (default: %d)"
+             % server.DEFAULT_PORT,
+        metavar="PORT",
+        default=server.DEFAULT_PORT)
+
+    parser.add_option(
+        "--profile",
+        action="store_true",
+        dest="profile",
+        help="Print the time spent in each build phase, parser, macro and "
+             "source file to stderr",
+        default=False)
+
+    parser.add_option(
+        "--profile-json",
+        dest="profile_json",
+        help="Write the build profile as a JSON report to FILE; implies "
+             "--profile",
+        metavar="FILE",
+        default=None)
+
     parser.add_option(
         "-q", "--quiet",
         action="store_false",
@@ -129,6 +229,14 @@ def _parse_options(args=None):
         help="Write informational messages to stdout (enabled by default)",
         default=True)
 
+    parser.add_option(
+        "-w", "--watch",
+        action="store_true",
+        dest="watch",
+        help="Keep running and build the presentation again whenever its "
+             "sources, theme or user assets change",
+        default=False)
+
     parser.add_option(
         "-x", "--extensions",
         dest="extensions",
@@ -148,9 +256,51 @@ def _parse_options(args=None):
         else:  # tests
             return 1
 
+    options.inputs = pargs
+
     return options, pargs[0]
 
 
+def get_batch(inputs):
+    """ Returns the list of configuration files to build from the command
+        line positional ``inputs``, or ``None`` if a single presentation is
+        to be built. Several configuration files can be passed directly, or
+        listed in a manifest file given to the ``build-all`` command.
+    """
+    if inputs[0] == 'build-all':
+        if len(inputs) != 2:
+            raise ValueError(u"The build-all command takes a single manifest "
+                              "file")
+        config_files = read_batch_manifest(inputs[1])
+    elif len(inputs) > 1:
+        config_files = inputs
+    else:
+        return None
+    for config_file in config_files:
+        if not config_file.endswith('.cfg'):
+            raise ValueError(u"Only configuration files can be built in "
+                              "batch, got %s" % config_file)
+    return config_files
+
+
+def read_batch_manifest(manifest_file):
+    """ Reads the configuration files listed in a ``build-all`` manifest,
+        one per line. Blank lines and lines starting with ``#`` are ignored,
+        relative paths are relative to the manifest directory.
+    """
+    try:
+        lines = open(manifest_file).read().splitlines()
+    except IOError, e:
+        raise IOError(u"Unable to read manifest %s: %s" % (manifest_file, e))
+    base_dir = os.path.dirname(manifest_file)
+    config_files = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            config_files.append(os.path.join(base_dir, line))
+    return config_files
+
+
 def log(message, type):
     """Basic logger, print output directly to stdout and errors to stderr.
     """
@@ -161,7 +311,171 @@ def run(input_file, options):
     """ Runs the Generator using parsed options.
     """
     options.logger = log
-    generator.Generator(input_file, **options.__dict__).execute()
+    if options.watch:
+        # Unchanged sources are kept parsed in memory between builds
+        options.incremental = True
+    if options.profile_json:
+        options.profile = True
+    g = generator.Generator(input_file, **options.__dict__)
+    if options.watch:
+        watch(g, options.profile_json)
+    else:
+        g.execute()
+        if options.profile:
+            write_profile(g.profiler, options.profile_json)
+
+
+def write_profile(profiler, json_file=None, title=None):
+    """ Prints a build profile table to stderr, under ``title`` if provided,
+        and writes its JSON report to ``json_file`` if provided.
+    """
+    if title:
+        sys.stderr.write(title.encode('utf_8') + "\n")
+    sys.stderr.write(profiler.get_table().encode('utf_8') + "\n")
+    if json_file:
+        try:
+            with open(json_file, 'w') as outfile:
+                outfile.write(profiler.get_json())
+        except IOError, e:
+            raise IOError(u"Unable to write profile report %s: %s"
+                          % (json_file, e))
+
+
+def run_batch(config_files, options):
+    """ Builds several presentations in a single process, so that modules
+        are imported once and parsers, templates, lexers and images caches
+        are shared by all builds. With more than one job, presentations are
+        built by a pool of worker processes. With ``--profile``, a profile
+        table is printed for each presentation. Returns the list of
+        ``(config_file, error)`` tuples of failed builds.
+    """
+    options.logger = log
+    if options.watch:
+        raise ValueError(u"Watch mode is not available when building several "
+                          "presentations")
+    if options.profile_json:
+        raise ValueError(u"JSON profile reports are not available when "
+                          "building several presentations")
+    kwargs = dict(options.__dict__)
+    jobs = min(options.jobs or 1, len(config_files))
+    tasks = [(config_file, kwargs) for config_file in config_files]
+    if jobs > 1:
+        # Presentations are built in parallel, not their sources
+        kwargs['jobs'] = 1
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(_build, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_build(task) for task in tasks]
+    if options.profile:
+        for config_file, (error, records) in zip(config_files, results):
+            if records is not None:
+                report = profiler.Profiler()
+                report.merge(records)
+                write_profile(report, title=u"Profile of %s" % config_file)
+    failures = [(config_file, error)
+                for config_file, (error, records) in zip(config_files, results)
+                if error]
+    for config_file, error in failures:
+        log(u"Error: %s: %s" % (config_file, error), 'error')
+    return failures
+
+
+def _build(task):
+    """ Builds a single presentation of a batch. Returns the error message
+        if the build failed, ``None`` otherwise, along with the build profile
+        records if profiling is enabled.
+    """
+    config_file, kwargs = task
+    try:
+        g = generator.Generator(config_file, **kwargs)
+        g.execute()
+    except Exception, e:
+        if kwargs.get('debug'):
+            raise
+        return unicode(e), None
+    return None, g.profiler.records if g.profiler.enabled else None
+
+
+def serve(inputs, options):
+    """ Serves a presentation over HTTP, rendered in memory and built again
+        whenever the files it depends on change, until interrupted.
+    """
+    if len(inputs) != 1:
+        raise ValueError(u"The serve command takes a single presentation "
+                          "source")
+    options.logger = log
+    g = generator.Generator(inputs[0], **options.__dict__)
+    # Assets are served from the local paths found in the presentation,
+    # whatever the configuration file says
+    g.relative = True
+    for asset in g.user_css + g.user_js:
+        asset['path_url'] = utils.get_path_url(asset['path'], True)
+    if g.file_type != 'html':
+        raise IOError(u"Only html presentations can be served")
+    s = server.PreviewServer(g, (options.host, options.port))
+    s.build()
+    s.watch()
+    log(u"Serving presentation on %s, press Ctrl+C to stop" % s.url,
+        'notice')
+    try:
+        s.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        s.server_close()
+
+
+def watch(g, profile_json=None):
+    """ Builds the presentation, then builds it again each time one of the
+        files it depends on changes, until interrupted. When profiling, a
+        report is written after each build.
+    """
+    build(g, profile_json)
+    # Build outputs are written through temporary files next to them
+    ignore = []
+    for path in (g.destination_file, g.manifest_file):
+        if path:
+            ignore.append(path)
+            ignore.append(os.path.join(os.path.dirname(path), '*.tmp'))
+            ignore.append(os.path.join(
+                os.path.dirname(os.path.realpath(path)), '*.tmp'))
+    if g.cache_dir:
+        ignore.append(os.path.join(g.cache_dir, '*'))
+    w = watcher.Watcher(g.get_watched_paths(), ignore=ignore)
+    log(u"Watching for changes, press Ctrl+C to stop", 'notice')
+    try:
+        while True:
+            changes = w.wait()
+            for path in changes:
+                log(u"Changed  %s" % path, 'notice')
+            user_assets = [os.path.abspath(asset['path'])
+                           for asset in g.user_css + g.user_js]
+            if set(changes) & set(user_assets):
+                g.reload_user_assets()
+            try:
+                build(g, profile_json)
+            except Exception, e:
+                if g.debug:
+                    raise
+                log(u"Error: %s" % e, 'error')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        w.close()
+
+
+def build(g, profile_json=None):
+    """ Builds the presentation of a watch mode session. When profiling, the
+        report only covers this build.
+    """
+    g.profiler.reset()
+    g.execute()
+    if g.profiler.enabled:
+        write_profile(g.profiler, profile_json)
 
 
 def main():
@@ -169,14 +483,21 @@ def main():
     """
     options, input_file = _parse_options()
 
-    if (options.debug):
-        run(input_file, options)
-    else:
-        try:
+    try:
+        if options.inputs[0] == 'serve':
+            serve(options.inputs[1:], options)
+            return
+        config_files = get_batch(options.inputs)
+        if config_files:
+            if run_batch(config_files, options):
+                sys.exit(1)
+        else:
             run(input_file, options)
-        except Exception, e:
-            sys.stderr.write("Error: %s\n" % e)
-            sys.exit(1)
+    except Exception, e:
+        if options.debug:
+            raise
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -22,6 +22,36 @@ SUPPORTED_FORMATS = {
     'textile':          ['.textile'],
 }
 
+# Supported formats, indexed by their extensions
+EXTENSIONS_FORMATS = dict((supp_extension, supp_format)
+                          for supp_format, supp_extensions
+                          in SUPPORTED_FORMATS.items()
+                          for supp_extension in supp_extensions)
+
+# Markdown converters, indexed by their extensions list
+_markdown_converters = {}
+
+
+def get_markdown_converter(extensions):
+    """Returns a ``markdown.Markdown`` converter using ``extensions``. Setting
+       up the converter and its extensions is costly, so a single instance is
+       shared for each extensions list; it must be reset between documents.
+    """
+    key = tuple(extensions)
+    if key not in _markdown_converters:
+        import markdown
+        _markdown_converters[key] = markdown.Markdown(extensions=list(key))
+    return _markdown_converters[key]
+
+
+def get_versions():
+    """Returns the versions of the libraries parsers rely on. Upgrading them
+       may change the generated HTML.
+    """
+    import docutils
+    import markdown
+    return (markdown.version, docutils.__version__)
+
 
 class Parser(object):
     """This class generates the HTML code depending on which syntax is used in
@@ -30,32 +60,38 @@ class Parser(object):
        The Parser currently supports both Markdown and restructuredText
        syntaxes.
     """
-    RST_REPLACEMENTS = [
-            (r'<div.*?>', r'', re.UNICODE),
-            (r'</div>', r'', re.UNICODE),
-            (r'<p class="system-message-\w+">.*?</p>', r'', re.UNICODE),
-            (r'Document or section may not begin with a transition\.',
-             r'', re.UNICODE),
-            (r'<h(\d+?).*?>', r'<h\1>', re.DOTALL | re.UNICODE),
-            (r'<hr.*?>\n', r'<hr />\n', re.DOTALL | re.UNICODE),
-    ]
+    # RST generates pretty much markup to be removed in our case: divs,
+    # system messages and transition warnings are dropped, headings and
+    # horizontal rules are stripped from their attributes. All of it is done
+    # in a single pass over the document.
+    RST_CLEANUP_RE = re.compile(
+        r'(?P<remove><div.*?>|</div>'
+        r'|<p class="system-message-\w+">.*?</p>'
+        r'|Document or section may not begin with a transition\.)'
+        r'|<h(?P<level>\d+?)[\s\S]*?>'
+        r'|(?P<hr><hr[\s\S]*?>\n)', re.UNICODE)
     md_extensions = ''
 
     def __init__(self, extension, encoding='utf8', md_extensions=''):
         """Configures this parser.
         """
         self.encoding = encoding
-        self.format = None
-        for supp_format, supp_extensions in SUPPORTED_FORMATS.items():
-            for supp_extension in supp_extensions:
-                if supp_extension == extension:
-                    self.format = supp_format
+        self.format = EXTENSIONS_FORMATS.get(extension)
         if not self.format:
             raise NotImplementedError(u"Unsupported format %s" % extension)
         if md_extensions:
             exts = (value.strip() for value in md_extensions.split(','))
             self.md_extensions = filter(None, exts)
 
+    @staticmethod
+    def rst_cleanup(match):
+        """Returns the replacement of a ``RST_CLEANUP_RE`` match."""
+        if match.group('level'):
+            return u'<h%s>' % match.group('level')
+        elif match.group('hr'):
+            return u'<hr />\n'
+        return u''
+
     def parse(self, text):
         """Parses and renders a text as HTML regarding current format.
         """
@@ -68,16 +104,15 @@ class Parser(object):
             if text.startswith(u'\ufeff'):  # check for unicode BOM
               text = text[1:]
 
-            return markdown.markdown(text, self.md_extensions)
+            converter = get_markdown_converter(self.md_extensions)
+            return converter.reset().convert(text)
         elif self.format == 'restructuredtext':
             try:
                 from parser_rst import html_body
             except ImportError:
                 raise RuntimeError(u"Looks like docutils are not installed")
             html = html_body(text, input_encoding=self.encoding)
-            # RST generates pretty much markup to be removed in our case
-            for (pattern, replacement, mode) in self.RST_REPLACEMENTS:
-                html = re.sub(re.compile(pattern, mode), replacement, html, 0)
+            html = self.RST_CLEANUP_RE.sub(self.rst_cleanup, html)
             return html.strip()
         elif self.format == 'textile':
             try:
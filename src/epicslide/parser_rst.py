@@ -14,7 +14,9 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-from docutils import core, nodes
+import copy
+
+from docutils import core, io, nodes
 from docutils.parsers.rst import directives, Directive
 
 from pygments import highlight
@@ -25,6 +27,9 @@ from pygments.lexers import get_lexer_by_name, TextLexer
 DEFAULT = HtmlFormatter(noclasses=False)
 VARIANTS = {}
 
+# Publishers, indexed by their settings overrides
+_publishers = {}
+
 
 class Pygments(Directive):
     """ Source code syntax hightlighting for ReST syntax."""
@@ -52,6 +57,52 @@ directives.register_directive('sourcecode', Pygments)
 directives.register_directive('code-block', Pygments)
 
 
+class HTMLPublisher(object):
+    """
+    Publishes ReST strings as HTML document parts.
+
+    Building docutils settings requires setting up an option parser for all
+    the components, reading configuration files, and instantiating the reader,
+    parser and writer. This class does it once and reuses all of them for
+    every published document, which yields the very same output as
+    `core.publish_parts()`.
+    """
+    def __init__(self, **settings_overrides):
+        publisher = core.Publisher(source_class=io.StringInput,
+                                   destination_class=io.StringOutput)
+        publisher.set_components('standalone', 'restructuredtext', 'html')
+        publisher.process_programmatic_settings(None, settings_overrides,
+                                                None)
+        self.reader = publisher.reader
+        self.parser = publisher.parser
+        self.writer = publisher.writer
+        self.settings = publisher.settings
+
+    def publish_parts(self, source, source_path=None, destination_path=None):
+        """
+        Given an input string, returns a dictionary of HTML document parts.
+        """
+        # Settings are altered while publishing, always start from a copy
+        publisher = core.Publisher(self.reader, self.parser, self.writer,
+                                   settings=copy.copy(self.settings),
+                                   source_class=io.StringInput,
+                                   destination_class=io.StringOutput)
+        publisher.set_source(source, source_path)
+        publisher.set_destination(None, destination_path)
+        publisher.publish(enable_exit_status=False)
+        return dict(publisher.writer.parts)
+
+
+def get_publisher(**settings_overrides):
+    """
+    Returns the shared `HTMLPublisher` for these settings overrides.
+    """
+    key = tuple(sorted(settings_overrides.items()))
+    if key not in _publishers:
+        _publishers[key] = HTMLPublisher(**settings_overrides)
+    return _publishers[key]
+
+
 def html_parts(input_string, source_path=None, destination_path=None,
                input_encoding='unicode', doctitle=1, initial_header_level=1):
     """
@@ -80,10 +131,9 @@ def html_parts(input_string, source_path=None, destination_path=None,
     overrides = {'input_encoding': input_encoding,
                  'doctitle_xform': doctitle,
                  'initial_header_level': initial_header_level}
-    parts = core.publish_parts(
-        source=input_string, source_path=source_path,
-        destination_path=destination_path,
-        writer_name='html', settings_overrides=overrides)
+    publisher = get_publisher(**overrides)
+    parts = publisher.publish_parts(input_string, source_path=source_path,
+                                    destination_path=destination_path)
     return parts
 
 
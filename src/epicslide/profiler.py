@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2010 Adam Zapletal
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+
+from contextlib import contextmanager
+from timeit import default_timer
+
+# Bump this when the format of JSON reports changes
+REPORT_VERSION = 1
+# Order of categories in reports; other categories follow
+CATEGORIES = ('phases', 'parsers', 'macros', 'sources')
+
+
+class Profiler(object):
+    """Records the wall time, the number of calls and the number of bytes
+       processed by each step of a build. Steps are named, and grouped in
+       categories: build phases, parsers, macros and source files. A disabled
+       profiler records nothing.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = {}
+
+    def add(self, category, name, elapsed=0.0, calls=0, size=0):
+        """Adds time, calls and bytes to the ``name`` step record."""
+        if not self.enabled:
+            return
+        record = self.records.setdefault((category, name), [0.0, 0, 0])
+        record[0] += elapsed
+        record[1] += calls
+        record[2] += size
+
+    @contextmanager
+    def measure(self, category, name, size=0):
+        """Context manager recording a call of the ``name`` step, processing
+           ``size`` bytes, and the time spent in the managed block.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.add(category, name, default_timer() - start, 1, size)
+
+    def iterate(self, category, name, iterable):
+        """Iterates over ``iterable`` and records the time spent getting each
+           item as a call of the ``name`` step, along with the item size.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = default_timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(category, name, default_timer() - start)
+                return
+            self.add(category, name, default_timer() - start, 1, len(item))
+            yield item
+
+    def merge(self, records):
+        """Adds the records of another profiler, eg. a worker process one."""
+        for (category, name), (elapsed, calls, size) in records.items():
+            self.add(category, name, elapsed, calls, size)
+
+    def reset(self):
+        """Discards every record."""
+        self.records = {}
+
+    def get_report(self):
+        """Returns the records as a dict of categories, each one being a dict
+           of steps with their ``time``, ``calls`` and ``bytes``.
+        """
+        report = {'version': REPORT_VERSION, 'categories': {}}
+        for (category, name), (elapsed, calls, size) in self.records.items():
+            steps = report['categories'].setdefault(category, {})
+            steps[name] = {'time': elapsed, 'calls': calls, 'bytes': size}
+        return report
+
+    def get_json(self):
+        """Returns the JSON report."""
+        return json.dumps(self.get_report(), indent=2, sort_keys=True)
+
+    def get_table(self):
+        """Returns the records as a text table. Steps are sorted by category,
+           then by decreasing time.
+        """
+        categories = sorted(set(category for category, name in self.records),
+                            key=lambda category: (
+                                CATEGORIES.index(category)
+                                if category in CATEGORIES
+                                else len(CATEGORIES), category))
+        rows = []
+        for category in categories:
+            steps = sorted(((name, record) for ((c, name), record)
+                            in self.records.items() if c == category),
+                           key=lambda step: (-step[1][0], step[0]))
+            for name, (elapsed, calls, size) in steps:
+                if not isinstance(name, unicode):
+                    name = name.decode('utf_8', 'replace')
+                rows.append((category, name, calls, elapsed, size))
+
+        width = max([len(u'Step')] + [len(row[1]) for row in rows])
+        line = u"%-8s  %-*s  %8s  %10s  %12s"
+        lines = [line % (u'Category', width, u'Step', u'Calls', u'Time (s)',
+                         u'Bytes')]
+        for category, name, calls, elapsed, size in rows:
+            lines.append(line % (category, width, name, calls,
+                                 u'%.4f' % elapsed, size or u'-'))
+        return u'\n'.join(lines)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2010 Adam Zapletal
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import hashlib
+import mimetypes
+import socket
+import threading
+import urllib
+import urlparse
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from cache import BuildManifest
+from watcher import Watcher
+
+# Themes fall back to the default theme files they don't provide
+DEFAULT_THEME_DIR = os.path.join(os.path.dirname(__file__), 'themes',
+                                 'default')
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+EVENTS_PATH = '/__events__'
+# Seconds between two keep alive messages sent to live reload clients
+KEEPALIVE_INTERVAL = 15
+
+RELOAD_JS = u"""<script>
+(function() {
+  if (!window.EventSource) {
+    return;
+  }
+  var events = new EventSource('%s');
+  events.addEventListener('reload', function() {
+    window.location.reload();
+  });
+})();
+</script>
+""" % EVENTS_PATH
+
+
+def add_reload_script(html):
+    """ Adds the live reload script at the end of the ``html`` document body.
+    """
+    index = html.rfind(u'</body>')
+    if index == -1:
+        return html + RELOAD_JS
+    return html[:index] + RELOAD_JS + html[index:]
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    """ Serves the presentation, its assets and live reload events.
+    """
+    def do_GET(self):
+        path = urllib.unquote(urlparse.urlsplit(self.path).path)
+        if path in ('/', '/index.html'):
+            html, etag = self.server.get_presentation()
+            if html is None:
+                self.send_error(503, "Presentation could not be built")
+            else:
+                self.send_contents(html, 'text/html; charset=utf-8', etag)
+        elif path == EVENTS_PATH:
+            self.send_events()
+        else:
+            self.send_asset(path)
+
+    def is_fresh(self, etag):
+        """ Checks if the client copy of a resource is still up to date.
+        """
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        etags = [value.strip() for value in header.split(',')]
+        return etag in etags or '*' in etags
+
+    def send_contents(self, contents, content_type, etag):
+        """ Sends ``contents``, or only a 304 response if the client already
+            has them.
+        """
+        if self.is_fresh(etag):
+            self.send_not_modified(etag)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(contents)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(contents)
+
+    def send_not_modified(self, etag):
+        """ Tells the client its copy of a resource is up to date.
+        """
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.end_headers()
+
+    def send_asset(self, path):
+        """ Sends a theme, user or slides asset file.
+        """
+        real_path = self.server.get_asset_path(path)
+        if not real_path:
+            self.send_error(404, "File not found")
+            return
+        stat = os.stat(real_path)
+        etag = '"%x-%x"' % (int(stat.st_mtime * 1000), stat.st_size)
+        if self.is_fresh(etag):
+            self.send_not_modified(etag)
+            return
+        content_type = (mimetypes.guess_type(real_path)[0]
+                        or 'application/octet-stream')
+        with open(real_path, 'rb') as asset:
+            self.send_contents(asset.read(), content_type, etag)
+
+    def send_events(self):
+        """ Streams live reload events, sent each time the presentation is
+            built again, until the client disconnects.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        version = self.server.version
+        try:
+            while not self.server.closed:
+                new_version = self.server.wait_for_build(version,
+                                                         KEEPALIVE_INTERVAL)
+                if new_version != version:
+                    version = new_version
+                    self.wfile.write('event: reload\ndata: %d\n\n' % version)
+                else:
+                    self.wfile.write(': keepalive\n\n')
+                self.wfile.flush()
+        except socket.error:
+            # Client went away
+            pass
+
+    def log_message(self, format, *args):
+        self.server.generator.log(u"Served   %s" % (format % args))
+
+
+class PreviewServer(ThreadingMixIn, HTTPServer):
+    """ Local HTTP server previewing a presentation. The generator is kept
+        in memory along with the rendered presentation, which is built again
+        each time its sources change. Only changed source files are parsed
+        again, and browsers are told to reload through Server-Sent Events.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, generator, address=(DEFAULT_HOST, DEFAULT_PORT)):
+        HTTPServer.__init__(self, address, PreviewHandler)
+        self.generator = generator
+        # Unchanged sources are kept parsed in memory between builds
+        self.generator.manifest = BuildManifest(None)
+        self.condition = threading.Condition()
+        self.html = None
+        self.etag = None
+        self.version = 0
+        self.closed = False
+        self.watcher = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def build(self):
+        """ Renders the presentation in memory, then notifies live reload
+            clients. On failure, the previous rendering is kept. Returns
+            ``True`` on success.
+        """
+        try:
+            self.generator.reload_user_assets()
+            html = add_reload_script(self.generator.render())
+        except Exception, e:
+            if self.generator.debug:
+                raise
+            self.generator.log(u"Error: %s" % e, 'error')
+            return False
+        html = html.encode('utf_8')
+        with self.condition:
+            self.html = html
+            self.etag = '"%s"' % hashlib.sha1(html).hexdigest()
+            self.version += 1
+            self.condition.notify_all()
+        return True
+
+    def get_presentation(self):
+        """ Returns the rendered presentation and its ETag.
+        """
+        with self.condition:
+            return self.html, self.etag
+
+    def get_asset_path(self, path):
+        """ Returns the local path of the file served at url ``path``, or
+            ``None`` if there's no such file or if it's outside of the
+            presentation sources, theme and assets directories.
+        """
+        candidates = [os.path.join(os.getcwd(), path.lstrip('/'))]
+        if os.path.isabs(path):
+            candidates.append(path)
+        roots = self.get_asset_roots()
+        for candidate in candidates:
+            real_path = os.path.realpath(candidate)
+            if not os.path.isfile(real_path):
+                continue
+            for root in roots:
+                if real_path.startswith(root + os.sep):
+                    return real_path
+        return None
+
+    def get_asset_roots(self):
+        """ Returns the directories files can be served from: those of the
+            presentation sources, theme and user assets. The current
+            directory isn't one of them, as it may hold anything.
+        """
+        paths = [DEFAULT_THEME_DIR] + self.generator.get_watched_paths()
+        roots = set()
+        for path in paths:
+            if not os.path.isdir(path):
+                path = os.path.dirname(os.path.abspath(path))
+            roots.add(os.path.realpath(path))
+        return roots
+
+    def wait_for_build(self, version, timeout):
+        """ Waits for ``timeout`` seconds at most for a build more recent
+            than ``version``, and returns the current build version.
+        """
+        with self.condition:
+            if self.version == version and not self.closed:
+                self.condition.wait(timeout)
+            return self.version
+
+    def watch(self):
+        """ Builds the presentation again each time one of the files it
+            depends on changes, from a background thread.
+        """
+        self.watcher = Watcher(self.generator.get_watched_paths())
+
+        def run():
+            while not self.closed:
+                try:
+                    changes = self.watcher.wait()
+                except Exception:
+                    if self.closed:
+                        return
+                    raise
+                for path in changes:
+                    self.generator.log(u"Changed  %s" % path)
+                self.build()
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def server_close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.watcher:
+            self.watcher.close()
+        HTTPServer.server_close(self)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2010 Adam Zapletal
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import tempfile
+import cPickle as pickle
+
+# Size of pickled slides kept in memory before spooling them to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+class SlotsRecord(object):
+    """Base class for compact records holding their fields in slots. Fields
+       can also be accessed as items, like the dicts records replace.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        """Returns the ``key`` field value, or ``default`` if there's no such
+           field.
+        """
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.__slots__]
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        if not isinstance(other, self.__class__):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join('%s=%r' % item for item in self.items()))
+
+
+class SlideSource(SlotsRecord):
+    """The source file of slides. A single instance is shared by all the
+       slides of a file.
+    """
+    __slots__ = ('rel_path', 'abs_path')
+
+    def __init__(self, rel_path):
+        self.rel_path = rel_path
+        self.abs_path = os.path.abspath(rel_path)
+
+
+class Slide(SlotsRecord):
+    """A single slide template vars. Every slide of a presentation is kept
+       until it's rendered, so slides only hold slots rather than a dict.
+    """
+    __slots__ = ('header', 'title', 'level', 'content', 'classes', 'source',
+                 'presenter_notes', 'number')
+
+    def __init__(self, header=None, title=None, level=None, content=None,
+                 classes=None, source=None, presenter_notes=None,
+                 number=None):
+        self.header = header
+        self.title = title
+        self.level = level
+        self.content = content
+        self.classes = classes if classes is not None else []
+        self.source = source if source is not None else {}
+        self.presenter_notes = presenter_notes
+        self.number = number
+
+
+class SlideSpool(object):
+    """Sequence of slides, stored pickled in a temporary file as they're
+       appended, so that a presentation's slides are never all held in memory
+       at once. Small presentations don't go past ``max_size`` bytes and stay
+       in memory. Slides are read back one at a time while iterating.
+    """
+    def __init__(self, max_size=SPOOL_MAX_SIZE):
+        self.file = tempfile.SpooledTemporaryFile(max_size)
+        self.length = 0
+
+    def append(self, slide):
+        self.file.seek(0, os.SEEK_END)
+        pickle.dump(slide, self.file, pickle.HIGHEST_PROTOCOL)
+        self.length += 1
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        position = 0
+        for _ in xrange(self.length):
+            self.file.seek(position)
+            slide = pickle.load(self.file)
+            position = self.file.tell()
+            yield slide
+
+    def close(self):
+        """Releases the spool file."""
+        self.file.close()
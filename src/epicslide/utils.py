@@ -15,9 +15,53 @@
 #  limitations under the License.
 
 import os
+import re
+import json
 import base64
+import hashlib
+import urllib
 import mimetypes
 
+from collections import OrderedDict
+
+# Maximum size of the encoded images kept in cache, in bytes
+IMAGES_CACHE_MAX_SIZE = 32 * 1024 * 1024
+
+_data_urls = OrderedDict()
+_data_urls_size = 0
+
+# Transparent 1x1 gif, displayed until deduplicated embedded images are set
+PLACEHOLDER_IMAGE = (u"data:image/gif;base64,"
+                     u"R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+EMBEDDED_IMAGE_REF_RE = re.compile(r'data-embedded-image-path="([^"]+)"',
+                                   re.UNICODE)
+EMBEDDED_IMAGES_JS = u"""(function() {
+  var images = %s;
+  document.addEventListener('DOMContentLoaded', function() {
+    var elements = document.querySelectorAll('img[data-embedded-image]');
+    for (var i = 0; i < elements.length; i++) {
+      var image = images[elements[i].getAttribute('data-embedded-image')];
+      if (image) {
+        elements[i].src = image;
+      }
+    }
+  });
+})();"""
+
+CSS_BACKGROUND_RE = re.compile(r'background(?:-image)?\s*:[^;{}]*',
+                               re.UNICODE)
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+?)\1\s*\)', re.UNICODE)
+
+def replace_file(src, dst):
+    """ Moves file ``src`` over file ``dst``. Renaming is atomic on POSIX
+        systems; on Windows, where ``os.rename`` doesn't replace existing
+        files, ``dst`` is removed first.
+    """
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
 def get_abs_path_url(path):
     """ Returns the absolute url for a given local path.
     """
@@ -46,7 +90,22 @@ def get_rel_path_url(path, base_path=os.getcwd()):
     except (IndexError, TypeError):
         return path
 
-def encode_image_from_url(url, source_path):
+def get_file_status(path):
+    """ Returns the ``(mtime, size)`` status of file ``path``, or ``None`` if
+        it doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+def get_image_path(url, source_path):
+    """ Returns the local path of an image url, resolved from
+        ``source_path`` when relative. Returns ``False`` for remote, already
+        embedded or missing images.
+    """
     if not url or url.startswith('data:') or url.startswith('file://'):
         return False
 
@@ -59,10 +118,51 @@ def encode_image_from_url(url, source_path):
         print '%s was not found, skipping' % url
         return False
 
+    return real_path
+
+
+def encode_image_from_url(url, source_path):
+    """ Returns a base64 data url of the image at ``url``, or ``False`` if it
+        can't be embedded. Encoded images are cached, indexed by their real
+        path, modification time and size, so that an image referenced many
+        times is read and encoded once. The cache holds up to
+        ``IMAGES_CACHE_MAX_SIZE`` bytes of encoded images.
+    """
+    real_path = get_image_path(url, source_path)
+    if not real_path:
+        return False
+
+    try:
+        stat = os.stat(real_path)
+    except OSError:
+        return False
+
+    global _data_urls_size
+    key = (os.path.realpath(real_path), stat.st_mtime, stat.st_size)
+    try:
+        data_url = _data_urls.pop(key)
+        _data_urls_size -= len(data_url or '')
+    except KeyError:
+        data_url = encode_image(real_path, url)
+    size = len(data_url or '')
+    if size <= IMAGES_CACHE_MAX_SIZE:
+        # Least recently used images are evicted first
+        while _data_urls and _data_urls_size + size > IMAGES_CACHE_MAX_SIZE:
+            evicted_key, evicted_url = _data_urls.popitem(last=False)
+            _data_urls_size -= len(evicted_url or '')
+        _data_urls[key] = data_url
+        _data_urls_size += size
+    return data_url
+
+
+def encode_image(real_path, url=None):
+    """ Reads and encodes the image at ``real_path`` as a base64 data url.
+        Returns ``False`` on failure.
+    """
     mime_type, encoding = mimetypes.guess_type(real_path)
 
     if not mime_type:
-        print 'Unrecognized mime type for %s, skipping' % url
+        print 'Unrecognized mime type for %s, skipping' % (url or real_path)
         return False
 
     try:
@@ -74,3 +174,82 @@ def encode_image_from_url(url, source_path):
         return False
 
     return u"data:%s;base64,%s" % (mime_type, encoded_image)
+
+
+def get_image_ref(real_path):
+    """ Returns the reference to an image written in slides by macros in
+        deduplicated embed mode, as their ``data-embedded-image-path``
+        attribute. References hold the image path, and are replaced by opaque
+        keys when the presentation is rendered.
+    """
+    real_path = os.path.realpath(real_path)
+    if isinstance(real_path, unicode):
+        real_path = real_path.encode('utf_8')
+    return urllib.quote(real_path)
+
+
+def get_image_key(real_path):
+    """ Returns the key identifying an image in deduplicated embed mode. Keys
+        don't disclose the layout of the author's filesystem.
+    """
+    real_path = os.path.realpath(real_path)
+    if isinstance(real_path, unicode):
+        real_path = real_path.encode('utf_8')
+    return hashlib.sha1(real_path).hexdigest()
+
+
+def replace_image_refs(html, images):
+    """ Replaces the images references found in ``html`` by their key, and
+        records their path in ``images``, indexed by key. Returns the new
+        html.
+    """
+    if not html:
+        return html
+
+    def replace_ref(match):
+        real_path = urllib.unquote(match.group(1).encode('utf_8'))
+        key = get_image_key(real_path)
+        images[key] = real_path
+        return u'data-embedded-image="%s"' % key
+
+    return EMBEDDED_IMAGE_REF_RE.sub(replace_ref, html)
+
+
+def get_images_js(images):
+    """ Returns the javascript code setting the images whose path is given
+        in ``images``, indexed by key, or ``None`` if none of them can be
+        encoded.
+    """
+    data_urls = {}
+    for key, real_path in images.items():
+        url = encode_image_from_url(real_path, '')
+        if url:
+            data_urls[key] = url
+    if not data_urls:
+        return None
+    return EMBEDDED_IMAGES_JS % json.dumps(data_urls, sort_keys=True)
+
+
+def embed_css_images(css, source_path, encoded_urls=None):
+    """ Replaces the images urls of background declarations found in ``css``
+        contents with base64 data urls, in a single pass. Relative urls are
+        resolved from ``source_path``. Images referenced several times are
+        read and encoded once; ``encoded_urls`` can be shared among calls to
+        extend this to several stylesheets.
+    """
+    if encoded_urls is None:
+        encoded_urls = {}
+
+    def embed_url(match):
+        quote, url = match.group(1), match.group(2)
+        key = (source_path, url)
+        if key not in encoded_urls:
+            encoded_urls[key] = encode_image_from_url(url, source_path)
+        if not encoded_urls[key]:
+            return match.group(0)
+        return u"url(%s%s%s)" % (quote, encoded_urls[key], quote)
+
+    def embed_declaration(match):
+        return CSS_URL_RE.sub(embed_url, match.group(0))
+
+    return CSS_BACKGROUND_RE.sub(embed_declaration, css)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2010 Adam Zapletal
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import time
+
+from fnmatch import fnmatch
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class Watcher(object):
+    """Watches a list of files and directories, recursively, and reports the
+       paths which changed. Uses inotify when ``pyinotify`` is installed and
+       falls back to polling files modification times otherwise. Changes
+       of ``ignore`` paths, which can be glob patterns, aren't reported.
+    """
+    def __init__(self, paths, interval=0.5, debounce=0.2, use_inotify=True,
+                 ignore=None):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.interval = interval
+        self.debounce = debounce
+        self.ignore = [os.path.abspath(path) for path in ignore or []]
+        self.pending = set()
+        self.notifier = None
+        if use_inotify and pyinotify:
+            self.start_inotify()
+        else:
+            self.snapshot = self.take_snapshot()
+
+    def start_inotify(self):
+        """Sets up inotify watches on every watched path."""
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE
+                | pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM
+                | pyinotify.IN_MOVED_TO | pyinotify.IN_MODIFY)
+        manager = pyinotify.WatchManager()
+        pending = self.pending
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                pending.add(event.pathname)
+
+        self.notifier = pyinotify.Notifier(manager, Handler(), timeout=0)
+        for path in self.paths:
+            if os.path.exists(path):
+                manager.add_watch(path, mask, rec=True, auto_add=True)
+
+    def take_snapshot(self):
+        """Returns a dict of watched files status, indexed by file path."""
+        snapshot = {}
+        for root in self.paths:
+            if os.path.isdir(root):
+                for dirpath, dirnames, filenames in os.walk(root):
+                    for filename in filenames:
+                        path = os.path.join(dirpath, filename)
+                        snapshot[path] = self.get_status(path)
+            else:
+                snapshot[root] = self.get_status(root)
+        return snapshot
+
+    def get_status(self, path):
+        """Returns a file modification time and size, or ``None`` if it
+           doesn't exist.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime, stat.st_size)
+
+    def poll(self, timeout):
+        """Waits for ``timeout`` seconds at most and returns the set of paths
+           which changed meanwhile.
+        """
+        if self.notifier:
+            if self.notifier.check_events(int(timeout * 1000)):
+                self.notifier.read_events()
+                self.notifier.process_events()
+        else:
+            time.sleep(timeout)
+            snapshot = self.take_snapshot()
+            for path in set(snapshot) | set(self.snapshot):
+                if snapshot.get(path) != self.snapshot.get(path):
+                    self.pending.add(path)
+            self.snapshot = snapshot
+
+        changes = set(path for path in self.pending
+                      if not self.is_ignored(path))
+        self.pending.clear()
+        return changes
+
+    def is_ignored(self, path):
+        """Checks if a changed path should not be reported."""
+        path = os.path.abspath(path)
+        return any(path == pattern or fnmatch(path, pattern)
+                   for pattern in self.ignore)
+
+    def wait(self):
+        """Blocks until some watched paths change, then waits for changes to
+           settle (eg. editors writing several files in a row) and returns
+           the sorted list of changed paths.
+        """
+        changes = set()
+        while not changes:
+            changes = self.poll(self.interval)
+        while True:
+            more_changes = self.poll(self.debounce)
+            if not more_changes:
+                break
+            changes |= more_changes
+        return sorted(changes)
+
+    def close(self):
+        """Releases inotify resources."""
+        if self.notifier:
+            self.notifier.stop()
+            self.notifier = None
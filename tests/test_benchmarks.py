@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../benchmarks"))
+
+import deck
+import run
+
+
+class TestBenchmarks(object):
+    def test_make_deck(self, tmpdir):
+        sources = deck.make_deck(str(tmpdir), 4, 3, rst_ratio=0.5, seed=1)
+        assert len(sources) == 4
+        assert tmpdir.join(deck.IMAGE_NAME).check()
+        assert set(os.path.splitext(s)[1] for s in sources) == \
+            set(['.md', '.rst'])
+        again = tmpdir.mkdir('again')
+        deck.make_deck(str(again), 4, 3, rst_ratio=0.5, seed=1)
+        for source in sources:
+            name = os.path.basename(source)
+            assert open(source).read() == again.join(name).read()
+
+    def test_make_deck_mix(self, tmpdir):
+        mix = {'code': 1, 'images': 1, 'notes': 1, 'fx': 1}
+        sources = deck.make_deck(str(tmpdir), 1, 2, mix, rst_ratio=0)
+        contents = open(sources[0]).read()
+        assert contents.count('    !') == 2
+        assert contents.count('](image.gif)') == 2
+        assert contents.count('.notes:') == 2
+        assert contents.count('.fx:') == 2
+
+    def test_run_benchmark(self, tmpdir):
+        results = run.run_benchmark(10, str(tmpdir), slides_per_file=5,
+                                    repeat=1)
+        assert sorted(results) == sorted(run.STEPS)
+        assert len(tmpdir.join('deck').listdir()) == 3
+        assert tmpdir.join('deck.html').check()
+
+    def test_compare(self):
+        results = {'10': dict((step, 1.0) for step in run.STEPS)}
+        baseline = {'10': {'fetch_contents': 1.0, 'render': 0.5}}
+        lines, regressions = run.compare(results, baseline, 0.2)
+        assert regressions == [('10', 'render')]
+        assert len(lines) == 1 + len(run.STEPS)
+
+    def test_save_baseline(self, tmpdir):
+        path = str(tmpdir.join('baseline.json'))
+        assert run.load_baseline(path) == {}
+        run.save_baseline(path, {'10': {'render': 1.0}})
+        run.save_baseline(path, {'1000': {'render': 2.0}})
+        assert run.load_baseline(path) == {'10': {'render': 1.0},
+                                           '1000': {'render': 2.0}}
+        assert json.load(open(path))['version'] == run.BASELINE_VERSION
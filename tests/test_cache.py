@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+from epicslide import cache
+
+
+class TestSlideCache(object):
+    def test_get_set(self, tmpdir):
+        c = cache.SlideCache(str(tmpdir.join('cache')))
+        key = c.key('foo', 1)
+        assert c.get(key) is None
+        assert c.get(key, []) == []
+        c.set(key, [{'title': u'plop'}])
+        assert c.get(key) == [{'title': u'plop'}]
+
+    def test_key(self, tmpdir):
+        c = cache.SlideCache(str(tmpdir))
+        assert c.key('foo', ('a', 'b')) == c.key('foo', ('a', 'b'))
+        assert c.key('foo', ('a', 'b')) != c.key('foo', ('b', 'a'))
+
+    def test_corrupted_entry(self, tmpdir):
+        c = cache.SlideCache(str(tmpdir))
+        key = c.key('foo')
+        open(c.get_path(key), 'wb').write('garbage')
+        assert c.get(key) is None
+
+    def test_evict(self, tmpdir):
+        c = cache.SlideCache(str(tmpdir), max_size=0)
+        keys = [c.key(i) for i in range(3)]
+        for i, key in enumerate(keys):
+            c.set(key, 'x' * 100)
+            os.utime(c.get_path(key), (time.time() - 100 + i,) * 2)
+        size = os.path.getsize(c.get_path(keys[0]))
+        c.max_size = size * 2
+        # Reading the oldest entry marks it as recently used
+        assert c.get(keys[0])
+        assert c.evict() == 1
+        assert c.get(keys[1]) is None
+        assert c.get(keys[0]) and c.get(keys[2])
+
+    def test_clear(self, tmpdir):
+        c = cache.SlideCache(str(tmpdir))
+        c.set(c.key('foo'), 'bar')
+        c.clear()
+        assert c.entries() == []
+
+
+class TestBuildManifest(object):
+    def test_update(self, tmpdir):
+        f = tmpdir.join('slides.md')
+        f.write('foo')
+        m = cache.BuildManifest(str(tmpdir.join('manifest')))
+        assert not m.load(('settings',))
+        assert m.get_slides(str(f)) is None
+        m.update(str(f), [{'title': u'foo'}, None])
+        assert m.get_slides(str(f)) == [{'title': u'foo'}, None]
+        f.write('foobar')
+        assert m.get_slides(str(f)) is None
+
+    def test_update_images(self, tmpdir):
+        f = tmpdir.join('slides.md')
+        f.write('foo')
+        image = tmpdir.join('image.gif')
+        image.write('gif')
+        m = cache.BuildManifest(str(tmpdir.join('manifest')))
+        m.load(('settings',))
+        status = (image.mtime(), image.size())
+        m.update(str(f), [{'title': u'foo'}], images={str(image): status})
+        assert m.get_slides(str(f)) == [{'title': u'foo'}]
+        image.write('gif89a')
+        assert m.get_slides(str(f)) is None
+
+    def test_save_load(self, tmpdir):
+        f = tmpdir.join('slides.md')
+        f.write('foo')
+        g = tmpdir.join('gone.md')
+        g.write('bar')
+        path = str(tmpdir.join('manifest'))
+        m = cache.BuildManifest(path)
+        m.load(('settings',))
+        m.update(str(f), [{'title': u'foo'}])
+        m.update(str(g), [{'title': u'bar'}])
+        m.save()
+        m = cache.BuildManifest(path)
+        assert m.load(('settings',))
+        assert m.get_slides(str(f)) == [{'title': u'foo'}]
+        m.save()
+        # Entries of files which weren't part of the last build are dropped
+        m = cache.BuildManifest(path)
+        assert m.load(('settings',))
+        assert str(g) not in m.entries
+        m = cache.BuildManifest(path)
+        assert not m.load(('other settings',))
+        assert m.entries == {}
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import codecs
 import sys
 import os
 import pytest
@@ -9,6 +10,7 @@ import shutil
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
 
 from epicslide.generator import *
+import epicslide.generator
 import epicslide.macro
 
 
@@ -250,6 +252,41 @@ class TestGenerator(object):
         f = self.factory_touch(tmpdir, "base.html")
         assert not g.get_template_file().endswith("/themes/default/base.html")
 
+    def test_get_template(self, tmpdir):
+        g = self.factory_generator(tmpdir)
+        template = g.get_template()
+        assert g.get_template() is template
+        g.template_file = self.factory_touch(tmpdir, "base.html")
+        assert g.get_template() is not template
+
+    def test_get_template_inheritance(self, tmpdir):
+        f = self.factory_source(tmpdir)
+        theme = tmpdir.join('mytheme')
+        shutil.copytree(os.path.join(THEMES_DIR, 'default'), str(theme))
+        html = Generator(f, theme=str(theme)).render()
+        theme.join('base.html').write('{% extends "default/base.html" %}')
+        assert Generator(f, theme=str(theme)).render() == html
+        source = codecs.open(os.path.join(THEMES_DIR, 'default', 'base.html'),
+                             encoding='utf8').read()
+        g = Generator(f, theme=str(theme))
+        assert jinja2.Template(source).render(g.get_context()) == html
+
+    def test_get_template_bytecode_cache(self, tmpdir):
+        f = self.factory_source(tmpdir)
+        cache_dir = tmpdir.join('cache')
+        Generator(f, cache_dir=str(cache_dir)).render()
+        assert cache_dir.join('templates').listdir()
+
+    def test_get_watched_paths(self, tmpdir):
+        g = self.factory_generator(tmpdir)
+        css = self.factory_css(tmpdir, "watched.css")
+        g.user_css = []
+        g.add_user_css(css)
+        paths = g.get_watched_paths()
+        assert g.source in paths
+        assert g.theme_dir in paths
+        assert css in paths
+
     def test_fetch_contents(self, tmpdir):
         f = self.factory_source(tmpdir)
         g = Generator(f)
@@ -293,6 +330,207 @@ class TestGenerator(object):
         assert c['source']['abs_path'].endswith("tmp.md")
         assert c['source']['rel_path'].endswith("tmp.md")
 
+    def test_fetch_contents_shared_source(self):
+        source = os.path.join(SAMPLES_DIR, 'example1', 'slides.md')
+        g = Generator(source)
+        slides = [s for s in g.fetch_contents(source) if s]
+        assert len(slides) > 1
+        assert all(s.source is slides[0].source for s in slides)
+        assert slides[0].source.rel_path == source
+
+    def test_iter_contents_lazy(self, tmpdir):
+        for name in ('a.md', 'b.md'):
+            tmpdir.join(name).write("# %s\n\n---\n\n# %s bis" % (name, name))
+        g = Generator(str(tmpdir))
+        parsed = []
+        parse_file_contents = g.parse_file_contents
+
+        def spy(source):
+            parsed.append(os.path.basename(source))
+            return parse_file_contents(source)
+
+        g.parse_file_contents = spy
+        slides = g.iter_contents(str(tmpdir))
+        assert next(slides).title == 'a.md'
+        assert parsed == ['a.md']
+        assert [s.title for s in slides] == ['a.md bis', 'b.md', 'b.md bis']
+        assert parsed == ['a.md', 'b.md']
+
+    def test_iter_sources(self, tmpdir):
+        tmpdir.mkdir('b').join('c.md').write('c')
+        tmpdir.join('a.md').write('a')
+        tmpdir.join('d.md').write('d')
+        g = Generator(str(tmpdir))
+        sources = g.iter_sources([str(tmpdir), [str(tmpdir.join('a.md'))]])
+        assert [os.path.relpath(s, str(tmpdir)) for s in sources] == \
+            ['a.md', os.path.join('b', 'c.md'), 'd.md', 'a.md']
+
+    @pytest.mark.parametrize('use_scandir', [True, False])
+    def test_iter_sources_prune(self, tmpdir, monkeypatch, use_scandir):
+        if not use_scandir:
+            monkeypatch.setattr(epicslide.generator, 'scandir', None)
+        tmpdir.mkdir('b.jpg').join('c.rst').write('c')
+        tmpdir.join('a.md').write('a')
+        tmpdir.join('a.jpg').write('a')
+        tmpdir.join('d.txt').write('d')
+        g = Generator(str(tmpdir))
+        sources = g.iter_sources([str(tmpdir), str(tmpdir.join('d.txt'))])
+        assert [os.path.relpath(s, str(tmpdir)) for s in sources] == \
+            ['a.md', os.path.join('b.jpg', 'c.rst'), 'd.txt']
+
+    def test_fetch_contents_jobs(self):
+        source = os.path.join(SAMPLES_DIR, 'example2')
+        g = Generator(source)
+        serial = g.fetch_contents(source)
+        g.jobs = 3
+        parallel = g.fetch_contents(source)
+        assert len(parallel) == len(serial)
+        assert [s['title'] for s in parallel] == [s['title'] for s in serial]
+        assert parallel == serial
+
+    def test_profile(self, tmpdir):
+        source = os.path.join(SAMPLES_DIR, 'example1', 'slides.md')
+        g = Generator(source, profile=True,
+                      destination_file=str(tmpdir.join('out.html')))
+        g.execute()
+        records = g.profiler.records
+        for step in ('build', 'fetch', 'read', 'template', 'template load'):
+            assert records[('phases', step)][1] >= 1
+        assert records[('parsers', 'markdown')][2] == os.path.getsize(source)
+        assert records[('macros', 'CodeHighlightingMacro')][1] >= 1
+        assert records[('sources', source)][1] == 1
+        assert records[('phases', 'template')][2] == \
+            len(tmpdir.join('out.html').read_text('utf_8'))
+
+    def test_profile_disabled(self, tmpdir):
+        g = self.factory_generator(tmpdir)
+        g.render()
+        assert g.profiler.records == {}
+
+    def test_profile_jobs(self):
+        source = os.path.join(SAMPLES_DIR, 'example2')
+        g = Generator(source, profile=True, jobs=2)
+        g.fetch_contents(source)
+        assert g.profiler.records[('parsers', 'markdown')][1] == 5
+        assert len([name for (category, name) in g.profiler.records
+                    if category == 'sources']) == 5
+
+    def test_fetch_contents_cache(self, tmpdir):
+        f = self.factory_source(tmpdir)
+        g = Generator(f, cache_dir=str(tmpdir.join('cache')))
+        c = g.fetch_contents(f)
+        assert len(g.cache.entries()) == 1
+        g.get_slide_vars = None  # cached slides don't need to be parsed
+        assert g.fetch_contents(f) == c
+        # Changing options invalidates cached slides
+        g.linenos = 'no'
+        with pytest.raises(TypeError):
+            g.fetch_contents(f)
+
+    def test_fetch_contents_cache_embedded_images(self, tmpdir):
+        shutil.copy(os.path.join(SAMPLES_DIR, 'example1', 'monkey.jpg'),
+                    str(tmpdir))
+        f = tmpdir.join('slides.md')
+        f.write("Foo\n===\n\n![monkey](monkey.jpg)")
+        g = Generator(str(f), embed=True, cache_dir=str(tmpdir.join('cache')))
+        before = g.fetch_contents(str(f))[0]['content']
+        image = tmpdir.join('monkey.jpg')
+        image.write(image.read('rb') + '\0', 'wb')
+        after = g.fetch_contents(str(f))[0]['content']
+        assert after != before
+        assert after == Generator(str(f), embed=True) \
+            .fetch_contents(str(f))[0]['content']
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_render_incremental_embedded_images(self, tmpdir, jobs):
+        shutil.copy(os.path.join(SAMPLES_DIR, 'example1', 'monkey.jpg'),
+                    str(tmpdir))
+        for name in ('a.md', 'b.md'):
+            tmpdir.join(name).write("Foo\n===\n\n![monkey](monkey.jpg)")
+        destination = str(tmpdir.join('presentation.html'))
+        kwargs = {'embed': True, 'destination_file': destination}
+        g = Generator(str(tmpdir), incremental=True, jobs=jobs, **kwargs)
+        before = g.render()
+        image = tmpdir.join('monkey.jpg')
+        image.write(image.read('rb') + '\0', 'wb')
+        g = Generator(str(tmpdir), incremental=True, jobs=jobs, **kwargs)
+        after = g.render()
+        assert after != before
+        assert after == Generator(str(tmpdir), **kwargs).render()
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_render_incremental_missing_entry(self, tmpdir, jobs):
+        f = self.factory_source(tmpdir)
+        destination = str(tmpdir.join('presentation.html'))
+        g = Generator(f, destination_file=destination, incremental=True,
+                      jobs=jobs)
+        # Entries which aren't source files are skipped, even missing ones
+        slides = g.fetch_contents([f, str(tmpdir.join('missing'))])
+        assert [s['title'] for s in slides] == ['Test']
+
+    def test_get_settings_versions(self, tmpdir):
+        import docutils
+        import pygments
+        settings = self.factory_generator(tmpdir).get_settings()
+        assert pygments.__version__ in settings
+        assert docutils.__version__ in settings
+
+    def test_render_incremental(self, tmpdir):
+        source_dir = tmpdir.mkdir('src')
+        f = self.factory_source(source_dir)
+        f2 = self.factory_source(source_dir, 'tmp2.md')
+        destination = str(tmpdir.join('presentation.html'))
+        g = Generator(str(source_dir), destination_file=destination,
+                      incremental=True)
+        g.render()
+        assert os.path.exists(destination + '.manifest')
+        g = Generator(str(source_dir), destination_file=destination,
+                      incremental=True)
+        parsed = []
+        parse_file_contents = g.parse_file_contents
+
+        def spy(source):
+            parsed.append(source)
+            return parse_file_contents(source)
+        g.parse_file_contents = spy
+        source_dir.join('tmp2.md').write("Test\n====\n\nfoo")
+        html = g.render()
+        assert parsed == [f2]
+        assert html == Generator(str(source_dir),
+                                 destination_file=destination).render()
+
+    def test_list_sources(self, tmpdir):
+        f = self.factory_source(tmpdir)
+        f2 = self.factory_source(tmpdir, 'tmp2.md')
+        g = Generator(f)
+        assert g.list_sources(str(tmpdir)) == [f, f2]
+        assert g.list_sources([f2, f]) == [f2, f]
+
+    def test_get_parser(self, tmpdir):
+        g = self.factory_generator(tmpdir)
+        p = g.get_parser('.md')
+        assert p.format == 'markdown'
+        assert g.get_parser('.md') is p
+        assert g.get_parser('.rst') is not p
+        assert g.get_parser('.jpg') is None
+        assert ('.jpg', g.encoding, g.extensions) not in \
+            epicslide.generator._parsers
+        assert g.get_parser('.jpg') is None
+
+    def test_shared_parsers_and_templates(self, tmpdir):
+        g1 = self.factory_generator(tmpdir)
+        g2 = Generator(self.factory_source(tmpdir, 'other.md'))
+        assert g1.get_parser('.md') is g2.get_parser('.md')
+        assert g1.get_template_environment() is \
+            g2.get_template_environment()
+
+    def test_user_assets_not_shared(self, tmpdir):
+        g1 = self.factory_generator(tmpdir)
+        g1.add_user_css(self.factory_css(tmpdir))
+        g2 = self.factory_generator(tmpdir)
+        assert len(g1.user_css) == 1
+        assert g2.user_css == []
+
     def test_find_theme_dir(self, tmpdir):
         g = self.factory_generator(tmpdir)
         g.copy_theme = True
@@ -341,6 +579,18 @@ class TestGenerator(object):
                                      {'title': None, 'level': 1}, ])
         assert svars['head_title'] == 'slide1'
 
+    def test_get_template_vars_iterator(self, tmpdir):
+        g = self.factory_generator(tmpdir)
+        slides = iter([{'title': "slide1", 'level': 1},
+                       None,
+                       {'title': "slide2", 'level': 2}])
+        svars = g.get_template_vars(slides)
+        assert svars['head_title'] == 'slide1'
+        assert svars['num_slides'] == '2'
+        assert len(svars['slides']) == 3
+        assert [s and s['number'] for s in svars['slides']] == [1, None, 2]
+        assert svars['toc'][0]['sub'][0]['title'] == "slide2"
+
     def test_linenos_check(self, tmpdir):
         g = self.factory_generator(tmpdir)
         for value in VALID_LINENOS:
@@ -381,6 +631,15 @@ class TestGenerator(object):
         assert r[1][0] == 'blah'
         assert r[1][1] == 'blob'
 
+    def test_get_macro_pipeline(self, tmpdir):
+        g = self.factory_generator(tmpdir)
+        pipeline = g.get_macro_pipeline()
+        assert g.get_macro_pipeline() is pipeline
+        assert len(pipeline.macros) == len(g.default_macros)
+        g.linenos = 'no'
+        assert g.get_macro_pipeline() is not pipeline
+        assert g.get_macro_pipeline().options['linenos'] == 'no'
+
     def test_register_macro(self, tmpdir):
         g = self.factory_generator(tmpdir)
 
@@ -400,6 +659,47 @@ class TestGenerator(object):
         g = self.factory_generator(tmpdir)
         assert g.render()
 
+    def test_render_twice(self, tmpdir):
+        g = self.factory_generator(tmpdir)
+        assert g.render() == g.render()
+        assert g.num_slides == 1
+
+    def test_render_embed_background(self, tmpdir):
+        f = self.factory_source(tmpdir)
+        g = Generator(f, embed=True, theme='tango')
+        html = g.render()
+        assert "url('data:image/png;base64," in html
+        assert "url('background.png')" not in html
+
+    def test_render_dedupe_images(self, tmpdir):
+        shutil.copy(os.path.join(SAMPLES_DIR, 'example1', 'monkey.jpg'),
+                    str(tmpdir))
+        f = tmpdir.join('slides.md')
+        f.write("Foo\n===\n\n![monkey](monkey.jpg)\n\n---\n\n"
+                "Bar\n===\n\n![monkey](monkey.jpg)\n")
+        g = Generator(str(f), embed=True)
+        encoded = utils.encode_image_from_url('monkey.jpg', str(tmpdir))
+        assert g.render().count(encoded) == 2
+        g = Generator(str(f), embed=True, dedupe_images=True)
+        html = g.render()
+        assert html.count(encoded) == 1
+        assert html.count('data-embedded-image=') == 2
+        # Keys don't disclose the author's filesystem
+        assert 'monkey.jpg' not in html
+        # Slides kept for the next build still reference their images
+        assert g.render() == html
+
+    def test_render_dedupe_header_images(self, tmpdir):
+        shutil.copy(os.path.join(SAMPLES_DIR, 'example1', 'monkey.jpg'),
+                    str(tmpdir))
+        f = tmpdir.join('slides.md')
+        f.write("# ![monkey](monkey.jpg) Title\n\nContents")
+        g = Generator(str(f), embed=True, dedupe_images=True)
+        html = g.render()
+        encoded = utils.encode_image_from_url('monkey.jpg', str(tmpdir))
+        assert html.count('data-embedded-image=') == 1
+        assert html.count(encoded) == 1
+
     def test_write(self, tmpdir):
         g = self.factory_generator(tmpdir)
         g.destination_file = str(tmpdir.join("presentation.html"))
@@ -407,6 +707,27 @@ class TestGenerator(object):
         assert os.path.exists(g.destination_file)
         assert unicode(file(g.destination_file).read(), 'utf_8')
 
+    def test_write_stream(self, tmpdir):
+        g = self.factory_generator(tmpdir)
+        g.destination_file = str(tmpdir.join("presentation.html"))
+        g.write()
+        html = codecs.open(g.destination_file, encoding='utf_8').read()
+        assert html == g.render()
+        assert u''.join(g.stream()) == html
+        assert tmpdir.listdir(lambda p: p.ext == '.tmp') == []
+        assert oct(os.stat(g.destination_file).st_mode & 0777) != '0600'
+
+    def test_write_symlink(self, tmpdir):
+        g = self.factory_generator(tmpdir)
+        target = tmpdir.mkdir('out').join('presentation.html')
+        target.write('old')
+        link = tmpdir.join('presentation.html')
+        link.mksymlinkto(target)
+        g.destination_file = str(link)
+        g.write()
+        assert link.islink()
+        assert target.read_text('utf_8') == g.render()
+
     def test_write_pdf(self, tmpdir):
         g = self.factory_generator(tmpdir)
         g.destination_file = str(tmpdir.join("presentation.pdf"))
@@ -414,6 +735,66 @@ class TestGenerator(object):
         g.write()
         assert os.path.exists(g.destination_file)
 
+    def test_write_pdf_weasyprint(self, tmpdir, monkeypatch):
+        calls = []
+
+        class HTML(object):
+            def __init__(self, string, base_url):
+                calls.append((string, base_url))
+
+            def write_pdf(self, target):
+                open(target, 'wb').write('%PDF')
+
+        weasyprint = type(sys)('weasyprint')
+        weasyprint.HTML = HTML
+        monkeypatch.setitem(sys.modules, 'weasyprint', weasyprint)
+        g = self.factory_generator(tmpdir)
+        g.destination_file = str(tmpdir.join("presentation.pdf"))
+        g.file_type = 'pdf'
+        g.write()
+        assert open(g.destination_file).read() == '%PDF'
+        assert calls == [(g.render(), os.getcwd() + os.sep)]
+
+    def test_write_pdf_chunks(self, tmpdir, monkeypatch):
+        PyPDF2 = pytest.importorskip('PyPDF2')
+
+        class HTML(object):
+            """Fake WeasyPrint document, with one page per slide. Each page
+               width is the slide number."""
+            def __init__(self, string, base_url):
+                self.numbers = re.findall(r'(\d+)/5\s*</aside>', string)
+
+            def write_pdf(self, target):
+                writer = PyPDF2.PdfFileWriter()
+                for number in self.numbers:
+                    writer.addBlankPage(int(number), 10)
+                writer.write(open(target, 'wb'))
+
+        weasyprint = type(sys)('weasyprint')
+        weasyprint.HTML = HTML
+        monkeypatch.setitem(sys.modules, 'weasyprint', weasyprint)
+        f = tmpdir.join('slides.md')
+        f.write('\n\n---\n\n'.join('Slide %d\n========' % i
+                                      for i in range(1, 6)))
+        g = Generator(str(f), destination_file=str(tmpdir.join('out.pdf')),
+                      jobs=2, pdf_chunk_size=2)
+        g.write()
+        pdf = PyPDF2.PdfFileReader(open(g.destination_file, 'rb'))
+        widths = [int(pdf.getPage(i).mediaBox.getWidth())
+                  for i in range(pdf.getNumPages())]
+        assert widths == [1, 2, 3, 4, 5]
+
+    def test_write_pdf_command_failure(self, tmpdir, monkeypatch):
+        command = tmpdir.join('weasyprint')
+        command.write("#!/bin/sh\necho 'plop failure' >&2\nexit 1\n")
+        command.chmod(0755)
+        monkeypatch.setenv('PATH', str(tmpdir), prepend=os.pathsep)
+        g = self.factory_generator(tmpdir)
+        g.destination_file = str(tmpdir.join("presentation.pdf"))
+        with pytest.raises(EnvironmentError) as e:
+            g.write_pdf_command(g.render())
+        assert 'plop failure' in str(e.value)
+
     def test_presenter_notes(self, tmpdir):
         g = self.factory_generator(tmpdir)
         svars = g.get_slide_vars("<h1>heading</h1>\n<p>foo</p>\n"
@@ -8,6 +8,7 @@ import re
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src/epicslide"))
 
 import macro
+import utils
 
 
 SAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', 'samples')
@@ -30,6 +31,30 @@ class ErrorMessage(Exception):
     pass
 
 
+def test_get_lexer():
+    lexer = macro.get_lexer('python')
+    assert lexer.name == 'Python'
+    assert macro.get_lexer('python') is lexer
+    with pytest.raises(ValueError):
+        macro.get_lexer('nosuchlanguage')
+    assert macro._lexers['nosuchlanguage'] is None
+
+
+def test_get_lexer_bounded(monkeypatch):
+    monkeypatch.setattr(macro, 'LEXERS_CACHE_SIZE', 2)
+    monkeypatch.setattr(macro, '_lexers', macro.OrderedDict())
+    for name in ('python', 'php', 'python', 'xml'):
+        macro.get_lexer(name)
+    assert list(macro._lexers) == ['python', 'xml']
+
+
+def test_get_formatter():
+    formatter = macro.get_formatter('table')
+    assert formatter.linenos
+    assert macro.get_formatter('table') is formatter
+    assert not macro.get_formatter(False).linenos
+
+
 class TestMacro(object):
     def test_process(self):
         m = macro.Macro()
@@ -42,6 +67,91 @@ class TestMacro(object):
             m = macro.Macro(options='plop')
 
 
+class TestMacroPipeline(object):
+    def test_process(self):
+        instances = []
+
+        class CountingMacro(macro.Macro):
+            def __init__(self, *args, **kwargs):
+                super(CountingMacro, self).__init__(*args, **kwargs)
+                instances.append(self)
+
+            def process(self, content, source=None):
+                return content + source, [u'counted']
+
+        pipeline = macro.MacroPipeline([CountingMacro, macro.NotesMacro],
+                                       options={'linenos': 'no'})
+        for source in ('a', 'b'):
+            context = macro.MacroContext(source)
+            content, classes = pipeline.process('<p>.notes: foo</p>',
+                                                context)
+            assert content == '<p class="notes">foo</p>' + source
+            assert classes == [u'counted', u'has_notes']
+            assert context.classes is classes
+        assert len(instances) == 1
+        assert instances[0].options is pipeline.macros[1].options
+
+    def test_process_failure(self):
+        messages = []
+
+        class FailingMacro(macro.Macro):
+            def process(self, content, source=None):
+                raise ValueError('plop')
+
+        pipeline = macro.MacroPipeline([FailingMacro, macro.FxMacro],
+                                       log=messages.append)
+        context = macro.MacroContext('foo.md')
+        r = pipeline.process('<p>.fx: blah</p>\n<p>baz</p>', context)
+        assert r == ('<p>baz</p>', ['blah'])
+        assert len(messages) == 1
+        assert 'plop' in messages[0]
+
+
+    def test_process_triggers(self):
+        calls = []
+
+        class TriggeredMacro(macro.Macro):
+            triggers = (u'.foo:',)
+
+            def process(self, content, source=None):
+                calls.append(content)
+                return content.replace('.foo:', '.bar:'), []
+
+        class BarMacro(TriggeredMacro):
+            triggers = (u'.bar:',)
+
+        pipeline = macro.MacroPipeline([TriggeredMacro, BarMacro])
+        pipeline.process('<p>nothing here</p>', macro.MacroContext())
+        assert calls == []
+        # BarMacro is triggered by TriggeredMacro output
+        r = pipeline.process('<p>.foo: baz</p>', macro.MacroContext())
+        assert r[0] == '<p>.bar: baz</p>'
+        assert calls == ['<p>.foo: baz</p>', '<p>.bar: baz</p>']
+
+    def test_process_overlapping_triggers(self):
+        calls = []
+
+        class AbMacro(macro.Macro):
+            triggers = (u'ab',)
+
+            def process(self, content, source=None):
+                calls.append(self.__class__.__name__)
+                return content, []
+
+        class BcMacro(AbMacro):
+            triggers = (u'bc',)
+
+        class AbcdMacro(AbMacro):
+            triggers = (u'abcd',)
+
+        pipeline = macro.MacroPipeline([AbMacro, BcMacro, AbcdMacro])
+        pipeline.process('<p>abc</p>', macro.MacroContext())
+        assert calls == ['AbMacro', 'BcMacro']
+        del calls[:]
+        pipeline.process('<p>abcd</p>', macro.MacroContext())
+        assert calls == ['AbMacro', 'BcMacro', 'AbcdMacro']
+
+
 class TestCodeHighlightingMacro(object):
     def setup_method(self, method):
         self.sample_html = '''<p>Let me give you this snippet:</p>
@@ -96,6 +206,36 @@ echo $bar;
         assert m.process(input)[0] == input
         assert m.process(input)[1] == []
 
+    def test_process_duplicate_blocks(self):
+        m = macro.CodeHighlightingMacro()
+        block = "<pre><code>!php\n$foo;</code></pre>"
+        hl = m.process(block)[0]
+        r = m.process("<p>a</p>%s<p>b</p>%s" % (block, block))
+        assert r[0] == "<p>a</p>%s<p>b</p>%s" % (hl, hl)
+
+    def test_process_unknown_lexer(self):
+        m = macro.CodeHighlightingMacro(logger=lambda *args: None)
+        content = ("<pre><code>!php\n$foo;</code></pre>"
+                   "<pre><code>!nosuchlanguage\nfoo</code></pre>"
+                   "<pre><code>!php\n$bar;</code></pre>")
+        r = m.process(content)
+        assert r[0].startswith('<div class="highlight">')
+        assert r[0].endswith("<pre><code>!nosuchlanguage\nfoo</code></pre>"
+                             "<pre><code>!php\n$bar;</code></pre>")
+        assert r[1] == []
+
+    def test_process_cache(self, tmpdir, monkeypatch):
+        import cache as cache_module
+        cache = cache_module.SlideCache(str(tmpdir))
+        m = macro.CodeHighlightingMacro(options={'cache': cache})
+        html = m.process(self.sample_html)[0]
+        assert len(cache.entries()) == 3
+
+        def fail(*args):
+            raise AssertionError('snippet highlighted again')
+        monkeypatch.setattr(macro.pygments, 'highlight', fail)
+        assert m.process(self.sample_html)[0] == html
+
     def test_process_rst_code_blocks(self):
         m = macro.CodeHighlightingMacro()
         hl = m.process(self.sample_html)
@@ -115,6 +255,30 @@ class TestEmbedImagesMacro(object):
         content, classes = m.process('<img src="monkey.jpg"/>', base_dir)
         assert re.match(r'<img src="data:image/jpeg;base64,(.+?)"/>', content)
 
+    def test_process_dedupe(self):
+        base_dir = os.path.join(SAMPLES_DIR, 'example1', 'slides.md')
+        m = macro.EmbedImagesMacro(lambda *args: None, True,
+                                   {'dedupe_images': True})
+        content, classes = m.process('<img src="monkey.jpg"/>', base_dir)
+        assert content.startswith('<img src="data:image/gif;base64,')
+        assert content.endswith(' data-embedded-image-path="%s"/>'
+                                % utils.get_image_ref(os.path.join(
+                                    SAMPLES_DIR, 'example1', 'monkey.jpg')))
+
+    def test_process_many(self):
+        base_dir = os.path.join(SAMPLES_DIR, 'example1', 'slides.md')
+        m = macro.EmbedImagesMacro(lambda *args: None, True)
+        content, classes = m.process('<p><img alt="a" src="monkey.jpg"/>'
+                                     '<img src="monkey.jpg" /></p>'
+                                     '<img src="toto.jpg"/>'
+                                     '<img src="monkey.jpg"/>', base_dir)
+        images = re.findall(r'<img.*?src="(.*?)".*?/>', content)
+        assert len(images) == 4
+        assert images[0].startswith('data:image/jpeg;base64,')
+        assert images[1] == images[0]
+        assert images[2:] == ['toto.jpg', 'monkey.jpg']
+        assert content.startswith('<p><img alt="a" src="data:')
+
 
 class TestFixImagePathsMacro(object):
     def test_process_embed_false(self):
@@ -24,6 +24,10 @@ class TestMain(object):
                                 'destination_file': 'presentation.html',
                                 'embed': False,
                                 'copy_theme': False,
+                                'jobs': 1,
+                                'watch': False,
+                                'host': '127.0.0.1',
+                                'port': 8000,
                                 }),
                               ([''],
                                {'presenter_notes': True,
@@ -40,7 +44,7 @@ class TestMain(object):
                                 'copy_theme': False,
                                 }),
                               (['-r', '-c', '-b', '-d', 'presentation.pdf',
-                                '-i', '-l', 'no', '-q', '-t', 'foo',
+                                '-i', '-j', '4', '-l', 'no', '-q', '-t', 'foo',
                                 'slides.md'],
                                {'presenter_notes': True,
                                 'verbose': False,
@@ -54,6 +58,7 @@ class TestMain(object):
                                 'destination_file': 'presentation.pdf',
                                 'embed': True,
                                 'copy_theme': True,
+                                'jobs': 4,
                                 }),
                               ],
                              )
@@ -72,6 +77,116 @@ class TestMain(object):
         r = main._parse_options(string)
         assert r == 1
 
+    def test_get_batch(self):
+        assert main.get_batch(['slides.md']) is None
+        assert main.get_batch(['a.cfg', 'b.cfg']) == ['a.cfg', 'b.cfg']
+        with pytest.raises(ValueError):
+            main.get_batch(['a.cfg', 'slides.md'])
+        with pytest.raises(ValueError):
+            main.get_batch(['build-all'])
+
+    def test_get_batch_manifest(self, tmpdir):
+        manifest = tmpdir.join('decks.txt')
+        manifest.write("# nightly decks\n"
+                       "one/config.cfg\n"
+                       "\n"
+                       "%s\n" % tmpdir.join('two.cfg'))
+        config_files = main.get_batch(['build-all', str(manifest)])
+        assert config_files == [str(tmpdir.join('one', 'config.cfg')),
+                                str(tmpdir.join('two.cfg'))]
+        with pytest.raises(IOError):
+            main.get_batch(['build-all', str(tmpdir.join('missing.txt'))])
+
+    @pytest.mark.parametrize('jobs', ['1', '2'])
+    def test_run_batch(self, tmpdir, jobs):
+        config_files = []
+        for name in ('one', 'two'):
+            source = tmpdir.join('%s.md' % name)
+            source.write("# Deck %s\n\nContents" % name)
+            config = tmpdir.join('%s.cfg' % name)
+            config.write("[epicslide]\nsource = %s\ndestination = %s\n"
+                         % (source, tmpdir.join('%s.html' % name)))
+            config_files.append(str(config))
+        broken = tmpdir.join('broken.cfg')
+        broken.write("[epicslide]\nsource = %s\n"
+                     % tmpdir.join('missing.md'))
+        config_files.append(str(broken))
+        options, input_file = main._parse_options(['-q', '-j', jobs]
+                                                  + config_files)
+        failures = main.run_batch(main.get_batch(options.inputs), options)
+        assert [config_file for config_file, e in failures] == [str(broken)]
+        for name in ('one', 'two'):
+            html = tmpdir.join('%s.html' % name).read()
+            assert 'Deck %s' % name in html
+
+    def test_run_batch_profile(self, tmpdir, capsys):
+        config_files = []
+        for name in ('one', 'two'):
+            source = tmpdir.join('%s.md' % name)
+            source.write("# Deck %s\n\nContents" % name)
+            config = tmpdir.join('%s.cfg' % name)
+            config.write("[epicslide]\nsource = %s\ndestination = %s\n"
+                         % (source, tmpdir.join('%s.html' % name)))
+            config_files.append(str(config))
+        options, input_file = main._parse_options(['-q', '--profile']
+                                                  + config_files)
+        assert main.run_batch(config_files, options) == []
+        out, err = capsys.readouterr()
+        for config_file in config_files:
+            assert "Profile of %s" % config_file in err
+        assert err.count('Category') == 2
+        options, input_file = main._parse_options(
+            ['-q', '--profile-json', str(tmpdir.join('p.json'))]
+            + config_files)
+        with pytest.raises(ValueError):
+            main.run_batch(config_files, options)
+
+    def test_watch_profile(self, tmpdir, monkeypatch, capsys):
+        source = tmpdir.join('slides.md')
+        source.write("# Title\n\nContents")
+        report = tmpdir.join('profile.json')
+        options, input_file = main._parse_options(
+            ['-q', '-w', '-d', str(tmpdir.join('out.html')),
+             '--profile-json', str(report), str(source)])
+        builds = []
+
+        class Watcher(object):
+            def __init__(self, paths, ignore=None):
+                pass
+
+            def wait(self):
+                if len(builds) == 2:
+                    raise KeyboardInterrupt
+                return [str(source)]
+
+            def close(self):
+                pass
+
+        execute = main.generator.Generator.execute
+
+        def spy(g):
+            builds.append(g.profiler.records.copy())
+            execute(g)
+
+        monkeypatch.setattr(main.watcher, 'Watcher', Watcher)
+        monkeypatch.setattr(main.generator.Generator, 'execute', spy)
+        main.run(input_file, options)
+        # Each build is reported on its own
+        assert builds == [{}, {}]
+        out, err = capsys.readouterr()
+        assert err.count('Category') == 2
+        assert '"phases"' in report.read()
+
+    def test_main_serve(self, monkeypatch):
+        calls = []
+        monkeypatch.setattr(sys, 'argv', ['epicslide', 'serve', 'slides.md'])
+        monkeypatch.setattr(main, 'serve', lambda inputs, options:
+                            calls.append(('serve', inputs)))
+        monkeypatch.setattr(main, 'run', lambda input_file, options:
+                            calls.append(('run', input_file)))
+        main.main()
+        assert calls == [('serve', ['slides.md'])]
+
     def test_log(self, capsys):
         main.log('foo', 'notice')
         main.log('bar', 'notice')
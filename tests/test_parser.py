@@ -2,11 +2,17 @@
 
 import sys
 import os
+import re
+import codecs
 import pytest
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
 
 from epicslide import parser
+from epicslide.parser_rst import html_body, html_parts
+
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', 'samples')
 
 
 class TestParserTest():
@@ -18,6 +24,11 @@ class TestParserTest():
         with pytest.raises(NotImplementedError):
             parser.Parser('.txt')
 
+    def test_extensions_formats(self):
+        assert parser.EXTENSIONS_FORMATS['.mdown'] == 'markdown'
+        assert parser.EXTENSIONS_FORMATS['.rest'] == 'restructuredtext'
+        assert '.jpg' not in parser.EXTENSIONS_FORMATS
+
     def test_init_md_extensions(self):
         p = parser.Parser('.md', md_extensions='a,b,c')
         assert p.md_extensions == ['a', 'b', 'c']
@@ -55,11 +66,61 @@ class TestParserTest():
         r = p.parse(input)
         assert r == output
 
+    @pytest.mark.parametrize(('filename', 'encoding'),
+                             [('slides.rst', 'utf8'),
+                              ('slides_h3.rst', 'utf8'),
+                              ('slides.koi8_r.rst', 'koi8_r')])
+    def test_rst_cleanup(self, filename, encoding):
+        replacements = [
+            (r'<div.*?>', r'', re.UNICODE),
+            (r'</div>', r'', re.UNICODE),
+            (r'<p class="system-message-\w+">.*?</p>', r'', re.UNICODE),
+            (r'Document or section may not begin with a transition\.',
+             r'', re.UNICODE),
+            (r'<h(\d+?).*?>', r'<h\1>', re.DOTALL | re.UNICODE),
+            (r'<hr.*?>\n', r'<hr />\n', re.DOTALL | re.UNICODE),
+        ]
+        path = os.path.join(SAMPLES_DIR, 'example3', filename)
+        text = codecs.open(path, encoding=encoding).read()
+        html = html_body(text, input_encoding=encoding)
+        expected = html
+        for (pattern, replacement, mode) in replacements:
+            expected = re.sub(re.compile(pattern, mode), replacement, expected)
+        p = parser.Parser('.rst', encoding)
+        assert p.parse(text) == expected.strip()
+
+    @pytest.mark.parametrize(('filename', 'encoding'),
+                             [('slides.rst', 'utf8'),
+                              ('slides_h3.rst', 'utf8'),
+                              ('slides.koi8_r.rst', 'koi8_r')])
+    def test_rst_html_parts(self, filename, encoding):
+        from docutils.core import publish_parts
+        path = os.path.join(SAMPLES_DIR, 'example3', filename)
+        text = codecs.open(path, encoding=encoding).read()
+        overrides = {'input_encoding': encoding, 'doctitle_xform': 1,
+                     'initial_header_level': 1}
+        expected = publish_parts(source=text, writer_name='html',
+                                 settings_overrides=overrides)
+        # Twice, so that the second document reuses the same publisher
+        assert html_parts(text, input_encoding=encoding) == expected
+        assert html_parts(text, input_encoding=encoding) == expected
+
     def test_parse_unicode_nom(self):
         p = parser.Parser('.md')
         r = p.parse(u'\ufeffplop')  # unicode BOM
         assert r == '<p>plop</p>'
 
+    def test_get_markdown_converter(self):
+        converter = parser.get_markdown_converter(['extra'])
+        assert parser.get_markdown_converter(['extra']) is converter
+        assert parser.get_markdown_converter([]) is not converter
+
+    def test_parse_footnotes_reset(self):
+        p = parser.Parser('.md', md_extensions='footnotes')
+        text = 'foo[^1]\n\n[^1]: bar'
+        assert p.parse(text) == p.parse(text)
+        assert p.parse('plop').find('bar') == -1
+
     def test_parse_unknown_format(self):
         p = parser.Parser('.md')
         p.format = '.plop'
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+from epicslide.profiler import Profiler
+
+
+class TestProfiler(object):
+    def test_measure(self):
+        p = Profiler()
+        with p.measure('phases', 'parse', 10):
+            pass
+        with p.measure('phases', 'parse', 5):
+            pass
+        elapsed, calls, size = p.records[('phases', 'parse')]
+        assert elapsed >= 0
+        assert calls == 2
+        assert size == 15
+
+    def test_disabled(self):
+        p = Profiler(enabled=False)
+        with p.measure('phases', 'parse', 10):
+            pass
+        p.add('phases', 'parse', 1.0, 1, 10)
+        assert p.records == {}
+
+    def test_iterate(self):
+        p = Profiler()
+        assert list(p.iterate('phases', 'template', [u'ab', u'cde'])) == \
+            [u'ab', u'cde']
+        assert p.records[('phases', 'template')][1:] == [2, 5]
+
+    def test_merge(self):
+        p = Profiler()
+        p.add('macros', 'FxMacro', 1.0, 1, 10)
+        worker = Profiler()
+        worker.add('macros', 'FxMacro', 2.0, 3, 5)
+        p.merge(worker.records)
+        assert p.records[('macros', 'FxMacro')] == [3.0, 4, 15]
+        p.reset()
+        assert p.records == {}
+
+    def test_report(self):
+        p = Profiler()
+        p.add('sources', 'slides.md', 0.5, 1, 100)
+        p.add('phases', 'walk', 0.25, 2)
+        report = json.loads(p.get_json())
+        assert report['categories']['sources']['slides.md'] == \
+            {'time': 0.5, 'calls': 1, 'bytes': 100}
+        assert report['categories']['phases']['walk']['calls'] == 2
+
+    def test_table(self):
+        p = Profiler()
+        p.add('sources', 'slides.md', 0.5, 1, 100)
+        p.add('phases', 'walk', 0.25, 2)
+        p.add('phases', 'fetch', 1.0, 1)
+        lines = p.get_table().split(u'\n')
+        assert lines[0].startswith(u'Category')
+        assert lines[1].split() == [u'phases', u'fetch', u'1', u'1.0000', u'-']
+        assert lines[2].split() == [u'phases', u'walk', u'2', u'0.2500', u'-']
+        assert lines[3].split() == [u'sources', u'slides.md', u'1',
+                                    u'0.5000', u'100']
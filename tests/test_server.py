@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import socket
+import threading
+import urllib2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+from epicslide import main
+from epicslide.generator import Generator
+from epicslide.server import PreviewServer, add_reload_script, EVENTS_PATH
+
+
+class TestServer(object):
+    def factory_server(self, tmpdir):
+        source = tmpdir.mkdir('slides')
+        source.join('a.md').write("# First\n\nContents")
+        source.join('b.md').write("# Second\n\n![monkey](monkey.jpg)")
+        source.join('monkey.jpg').write("not really a jpeg")
+        g = Generator(str(source), relative=True)
+        s = PreviewServer(g, ('127.0.0.1', 0))
+        thread = threading.Thread(target=s.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return s
+
+    def get(self, s, path, etag=None):
+        request = urllib2.Request(s.url + path.lstrip('/'))
+        if etag:
+            request.add_header('If-None-Match', etag)
+        try:
+            response = urllib2.urlopen(request, timeout=10)
+        except urllib2.HTTPError, e:
+            return e.code, e.headers, None
+        return response.getcode(), response.headers, response.read()
+
+    def test_add_reload_script(self):
+        html = add_reload_script(u"<html><body>foo</body></html>")
+        assert EVENTS_PATH in html
+        assert html.endswith(u"</script>\n</body></html>")
+        assert EVENTS_PATH in add_reload_script(u"foo")
+
+    def test_presentation(self, tmpdir):
+        s = self.factory_server(tmpdir)
+        try:
+            code, headers, body = self.get(s, '/')
+            assert code == 503
+            assert s.build()
+            code, headers, body = self.get(s, '/')
+            assert code == 200
+            assert 'First' in body
+            assert EVENTS_PATH in body
+            etag = headers['ETag']
+            code, headers, body = self.get(s, '/', etag)
+            assert code == 304
+            assert s.build()
+            # Same contents, same ETag
+            assert s.etag == etag
+        finally:
+            s.shutdown()
+            s.server_close()
+
+    def test_assets(self, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir)
+        tmpdir.join('secret.txt').write("secret")
+        s = self.factory_server(tmpdir)
+        try:
+            s.build()
+            css = os.path.join(s.generator.theme_dir, 'css', 'screen.css')
+            code, headers, body = self.get(s, css)
+            assert code == 200
+            assert headers['Content-Type'] == 'text/css'
+            assert body == open(css, 'rb').read()
+            code, headers, body = self.get(s, css, headers['ETag'])
+            assert code == 304
+            image = str(tmpdir.join('slides', 'monkey.jpg'))
+            code, headers, body = self.get(s, image)
+            assert code == 200
+            assert body == "not really a jpeg"
+            code, headers, body = self.get(s, '/etc/passwd')
+            assert code == 404
+            # The current directory isn't served
+            code, headers, body = self.get(s, '/secret.txt')
+            assert code == 404
+            code, headers, body = self.get(s, css + '.missing')
+            assert code == 404
+        finally:
+            s.shutdown()
+            s.server_close()
+
+    def test_events(self, tmpdir):
+        s = self.factory_server(tmpdir)
+        try:
+            s.build()
+            client = socket.create_connection(s.server_address, 10)
+            client.sendall("GET %s HTTP/1.0\r\n\r\n" % EVENTS_PATH)
+            threading.Timer(0.2, s.build).start()
+            data = ''
+            while not data.endswith('\n\n') or 'event:' not in data:
+                data += client.recv(1024)
+            client.close()
+            assert 'Content-Type: text/event-stream' in data
+            assert data.endswith('\r\n\r\nevent: reload\ndata: 2\n\n')
+        finally:
+            s.shutdown()
+            s.server_close()
+
+    def test_build_changed_sources(self, tmpdir):
+        s = self.factory_server(tmpdir)
+        parsed = []
+        parse_file_contents = s.generator.parse_file_contents
+
+        def spy(source):
+            parsed.append(os.path.basename(source))
+            return parse_file_contents(source)
+
+        s.generator.parse_file_contents = spy
+        try:
+            s.build()
+            assert sorted(parsed) == ['a.md', 'b.md']
+            del parsed[:]
+            source = tmpdir.join('slides', 'b.md')
+            source.write("# Second\n\nChanged contents")
+            s.build()
+            assert parsed == ['b.md']
+            assert 'Changed contents' in s.html
+            assert 'First' in s.html
+        finally:
+            s.shutdown()
+            s.server_close()
+
+    def test_serve_config(self, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir)
+        tmpdir.join('slides.md').write("# First\n\nContents")
+        tmpdir.join('style.css').write("body {}")
+        config = tmpdir.join('config.cfg')
+        config.write("[epicslide]\nsource = slides.md\ncss = style.css\n"
+                     "relative = False\n")
+        served = []
+
+        def serve_forever(s):
+            served.append(s.get_presentation()[0])
+            raise KeyboardInterrupt
+
+        monkeypatch.setattr(PreviewServer, 'serve_forever', serve_forever)
+        options, input_file = main._parse_options(['-q', '-p', '0', 'serve',
+                                                   str(config)])
+        main.serve(options.inputs[1:], options)
+        assert 'First' in served[0]
+        assert 'file://' not in served[0]
+        assert 'href="style.css"' in served[0]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import pytest
+import cPickle as pickle
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+from epicslide.slide import Slide, SlideSource, SlideSpool
+
+
+class TestSlide(object):
+    def test_slots(self):
+        s = Slide(title=u'foo')
+        assert not hasattr(s, '__dict__')
+        with pytest.raises(AttributeError):
+            s.foo = u'bar'
+
+    def test_defaults(self):
+        s = Slide()
+        assert s.title is None
+        assert s.classes == []
+        assert s.source == {}
+        assert s.number is None
+
+    def test_items(self):
+        s = Slide(header=u'<h1>foo</h1>', title=u'foo', level=1)
+        assert s['title'] == u'foo'
+        assert s.get('level') == 1
+        assert s.get('foo', u'bar') == u'bar'
+        assert 'content' in s
+        s['number'] = 3
+        assert s.number == 3
+        with pytest.raises(KeyError):
+            s['foo']
+        with pytest.raises(KeyError):
+            s['foo'] = u'bar'
+
+    def test_equality(self):
+        source = SlideSource('slides.md')
+        s = Slide(title=u'foo', source=source)
+        assert s == Slide(title=u'foo', source=SlideSource('slides.md'))
+        assert s != Slide(title=u'bar', source=source)
+        assert s.source == {'rel_path': 'slides.md',
+                            'abs_path': os.path.abspath('slides.md')}
+
+    def test_pickle(self):
+        source = SlideSource('slides.md')
+        slides = [Slide(title=u'foo', source=source, classes=[u'has_code']),
+                  Slide(title=u'bar', source=source)]
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            loaded = pickle.loads(pickle.dumps(slides, protocol))
+            assert loaded == slides
+            # Source references stay shared
+            assert loaded[0].source is loaded[1].source
+
+
+class TestSlideSpool(object):
+    def test_spool(self):
+        spool = SlideSpool(max_size=64)
+        slides = [Slide(title=u'slide %d' % i, number=i) for i in range(50)]
+        slides.insert(3, None)
+        for slide in slides:
+            spool.append(slide)
+        assert len(spool) == 51
+        assert list(spool) == slides
+        # Spool can be iterated again, and appended to meanwhile
+        iterator = iter(spool)
+        assert next(iterator) == slides[0]
+        spool.append(Slide(title=u'last'))
+        assert list(spool)[-1].title == u'last'
+        assert next(iterator) == slides[1]
+        spool.close()
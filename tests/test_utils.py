@@ -12,3 +12,87 @@ from epicslide import utils
 def test_get_path_url_relative():
     u = utils.get_path_url('/plop', relative=True)
     assert u == '/plop'
+
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', 'samples')
+
+
+def test_embed_css_images():
+    source_path = os.path.join(SAMPLES_DIR, 'example1')
+    css = ("body {\n  background: url('monkey.jpg') no-repeat;\n}\n"
+           "p { background-image:url(monkey.jpg); }\n"
+           "div { background: url(\"notfound.jpg\"); }\n"
+           "@import url(monkey.jpg);\n")
+    encoded_urls = {}
+    r = utils.embed_css_images(css, source_path, encoded_urls)
+    encoded = utils.encode_image_from_url('monkey.jpg', source_path)
+    assert r == ("body {\n  background: url('%s') no-repeat;\n}\n"
+                 "p { background-image:url(%s); }\n"
+                 "div { background: url(\"notfound.jpg\"); }\n"
+                 "@import url(monkey.jpg);\n" % (encoded, encoded))
+    assert len(encoded_urls) == 2
+
+
+@pytest.mark.parametrize('name', ['posix', 'nt'])
+def test_replace_file(tmpdir, monkeypatch, name):
+    monkeypatch.setattr(os, 'name', name)
+    src = tmpdir.join('src')
+    dst = tmpdir.join('dst')
+    dst.write('old')
+    src.write('new')
+    utils.replace_file(str(src), str(dst))
+    assert dst.read() == 'new'
+    assert not src.check()
+
+
+def test_encode_image_from_url_cache(tmpdir):
+    f = tmpdir.join('image.gif')
+    f.write('GIF89a', mode='wb')
+    encoded = utils.encode_image_from_url(str(f), '')
+    assert encoded == u'data:image/gif;base64,R0lGODlh'
+    assert utils.encode_image_from_url('image.gif', str(tmpdir)) is encoded
+    f.write('GIF89a;', mode='wb')
+    assert utils.encode_image_from_url(str(f), '') != encoded
+
+
+def test_encode_image_from_url_cache_size(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, '_data_urls', utils.OrderedDict())
+    monkeypatch.setattr(utils, '_data_urls_size', 0)
+    # Room for two encoded images
+    monkeypatch.setattr(utils, 'IMAGES_CACHE_MAX_SIZE', 60)
+    paths = []
+    for name in ('a', 'b', 'c'):
+        f = tmpdir.join('%s.gif' % name)
+        f.write('GIF89a', mode='wb')
+        paths.append(str(f))
+        utils.encode_image_from_url(str(f), '')
+    assert [key[0] for key in utils._data_urls] == paths[1:]
+    assert utils._data_urls_size == 60
+    monkeypatch.setattr(utils, 'IMAGES_CACHE_MAX_SIZE', 10)
+    big = tmpdir.join('big.gif')
+    big.write('GIF89a' * 10, mode='wb')
+    utils.encode_image_from_url(str(big), '')
+    assert str(big) not in [key[0] for key in utils._data_urls]
+
+
+def test_replace_image_refs():
+    image = os.path.join(SAMPLES_DIR, 'example1', 'monkey.jpg')
+    key = utils.get_image_key(image)
+    assert SAMPLES_DIR not in key
+    html = u'<img src="%s" data-embedded-image-path="%s"/>' % (
+        utils.PLACEHOLDER_IMAGE, utils.get_image_ref(image))
+    images = {}
+    html = utils.replace_image_refs(html * 2, images)
+    assert html.count(u'data-embedded-image="%s"' % key) == 2
+    assert 'monkey.jpg' not in html
+    assert images == {key: os.path.realpath(image)}
+    assert utils.replace_image_refs(None, images) is None
+
+
+def test_get_images_js():
+    image = os.path.join(SAMPLES_DIR, 'example1', 'monkey.jpg')
+    key = utils.get_image_key(image)
+    js = utils.get_images_js({key: image})
+    assert js.count(utils.encode_image_from_url(image, '')) == 1
+    assert key in js
+    assert utils.get_images_js({key: image + '.missing'}) is None
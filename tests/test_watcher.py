@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+from epicslide import watcher
+
+
+class TestWatcher(object):
+    def factory_watcher(self, tmpdir, **kwargs):
+        return watcher.Watcher([str(tmpdir)], interval=0.01, debounce=0.01,
+                               use_inotify=False, **kwargs)
+
+    def test_poll(self, tmpdir):
+        f = tmpdir.join('slides.md')
+        f.write('foo')
+        w = self.factory_watcher(tmpdir)
+        assert w.poll(0) == set()
+        f.write('foobar')
+        tmpdir.join('new.md').write('bar')
+        assert w.poll(0) == set([str(f), str(tmpdir.join('new.md'))])
+        f.remove()
+        assert w.poll(0) == set([str(f)])
+
+    def test_ignore(self, tmpdir):
+        w = self.factory_watcher(tmpdir,
+                                 ignore=[str(tmpdir.join('out.html'))])
+        tmpdir.join('out.html').write('foo')
+        assert w.poll(0) == set()
+
+    def test_ignore_pattern(self, tmpdir):
+        w = self.factory_watcher(tmpdir,
+                                 ignore=[str(tmpdir.join('*.tmp')),
+                                         str(tmpdir.join('cache', '*'))])
+        tmpdir.join('tmpXyZ.tmp').write('foo')
+        tmpdir.mkdir('cache').join('entry.cache').write('foo')
+        tmpdir.join('slides.md').write('foo')
+        assert w.poll(0) == set([str(tmpdir.join('slides.md'))])
+
+    def test_wait(self, tmpdir):
+        w = self.factory_watcher(tmpdir)
+        tmpdir.join('slides.md').write('foo')
+        assert w.wait() == [str(tmpdir.join('slides.md'))]